@@ -1,21 +1,41 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Form, Header, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import os
+import json
+import asyncio
+import hashlib
+import time
+import re
+import math
+import statistics
+import importlib.util
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
+from urllib.parse import urlsplit
+from thumbnail_worker import make_thumbnail
+import httpcore
 import httpx
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 from passlib.context import CryptContext
 import jwt
 import base64
+import multiprocessing
+import tempfile
 
 
 ROOT_DIR = Path(__file__).parent
@@ -23,11 +43,62 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)  # Datetimes are read back as aware UTC
 db = client[os.environ['DB_NAME']]
 
+# Index registry: applied idempotently at startup by ensure_indexes()
+# Emails are normalized to lower case before every write and lookup, so a plain
+# unique index enforces case-insensitive uniqueness.
+DB_INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("bundesland", ASCENDING)], name="bundesland"),
+        IndexModel([("first_chat_at", ASCENDING)], name="first_chat_at", sparse=True),
+    ],
+    "conversations": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING), ("id", DESCENDING)], name="user_updated"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+        IndexModel([("created_at", ASCENDING)], name="title_pending_created_at",
+                   partialFilterExpression={"title_pending": True}),
+    ],
+    "messages": [
+        IndexModel([("conversation_id", ASCENDING), ("seq", ASCENDING)], name="conversation_seq_unique", unique=True),
+    ],
+    "password_resets": [
+        IndexModel([("email", ASCENDING), ("reset_code", ASCENDING)], name="email_code"),
+        # Expired reset codes are removed by MongoDB
+        IndexModel([("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+    "feedback": [
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+    ],
+    "chat_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "rate_limits": [
+        # Idle buckets are full again by then and removed by MongoDB
+        IndexModel([("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+    "daily_stats": [
+        IndexModel([("day", ASCENDING), ("bundesland", ASCENDING)], name="day_bundesland_unique", unique=True),
+    ],
+    "daily_active_users": [
+        IndexModel([("day", ASCENDING), ("user_id", ASCENDING)], name="day_user_unique", unique=True),
+    ],
+    "active_user_sketches": [
+        IndexModel([("day", ASCENDING)], name="day_unique", unique=True),
+    ],
+}
+
 # N8N Webhook URL
 N8N_WEBHOOK_URL = os.environ['N8N_WEBHOOK_URL']
+# Optional comma separated list of equivalent webhook URLs to balance across
+N8N_WEBHOOK_URLS = [url.strip() for url in os.environ.get('N8N_WEBHOOK_URLS', N8N_WEBHOOK_URL).split(',') if url.strip()]
+# Optional rules sending requests to dedicated webhooks, e.g.
+# [{"action": "edit_image", "url": "https://..."}, {"bundesland": "Bayern", "url": "https://..."}]
+N8N_ROUTING_RULES = json.loads(os.environ.get('N8N_ROUTING_RULES', '[]'))
 
 # Emergent LLM Key for title generation
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY', '')
@@ -37,8 +108,11 @@ JWT_SECRET = os.environ['JWT_SECRET']
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24 * 7  # 7 days
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing: hashes with fewer rounds are upgraded on the next login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', '64'))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS)
 
 # Security
 security = HTTPBearer(auto_error=False)
@@ -73,12 +147,92 @@ class TokenResponse(BaseModel):
     user: UserResponse
 
 
+# Time Helpers
+def utc_now() -> datetime:
+    """Current UTC time at the millisecond precision BSON dates are stored with"""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def as_datetime(value) -> Optional[datetime]:
+    """Read a stored timestamp, which may still be an ISO string from before the
+    switch to native BSON dates"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
 # Auth Helper Functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+class PasswordHasher:
+    """Runs bcrypt in a dedicated thread pool so hashing never blocks the event loop.
+    
+    bcrypt releases the GIL, so PASSWORD_HASH_WORKERS threads hash in parallel.
+    At most PASSWORD_HASH_MAX_QUEUE calls wait for a worker; beyond that requests
+    are rejected with 503 instead of piling up behind a login burst."""
+    
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.pending = 0  # Submitted and not finished, running or queued
+        self.stats = {"completed": 0, "rejected": 0, "rehashed": 0, "wait_seconds": 0.0, "work_seconds": 0.0}
+    
+    def queued(self) -> int:
+        return max(0, self.pending - self.workers)
+    
+    async def run(self, func, *args):
+        if self.queued() >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Zu viele Anmeldungen gleichzeitig. Bitte versuche es gleich noch einmal.",
+                headers={"Retry-After": "1"}
+            )
+        queued_at = time.monotonic()
+        
+        def work():
+            started_at = time.monotonic()
+            return started_at, func(*args)
+        
+        self.pending += 1
+        try:
+            started_at, result = await asyncio.get_running_loop().run_in_executor(self.executor, work)
+        finally:
+            self.pending -= 1
+        self.stats["completed"] += 1
+        self.stats["wait_seconds"] += started_at - queued_at
+        self.stats["work_seconds"] += time.monotonic() - started_at
+        return result
+    
+    def metrics(self) -> dict:
+        completed = self.stats["completed"]
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": min(self.pending, self.workers),
+            "queued": self.queued(),
+            "completed": completed,
+            "rejected": self.stats["rejected"],
+            "rehashed": self.stats["rehashed"],
+            "avg_wait_ms": round(self.stats["wait_seconds"] / completed * 1000, 1) if completed else None,
+            "avg_work_ms": round(self.stats["work_seconds"] / completed * 1000, 1) if completed else None
+        }
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.run(pwd_context.hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(pwd_context.verify, plain_password, hashed_password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple:
+    """(valid, new hash or None if the stored hash is up to date)"""
+    return await password_hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
 
 def create_access_token(user_id: str) -> str:
     expire = datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
@@ -88,22 +242,98 @@ def create_access_token(user_id: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+# Authenticated user cache settings
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+
+
+class UserCache:
+    """Per-process LRU+TTL cache of verified tokens and user records.
+    
+    Tokens map to the user id they were verified for, until the token expires;
+    user records are kept for at most USER_CACHE_TTL_SECONDS. Endpoints that
+    change a user call invalidate(); other worker processes pick up the change
+    when their entry expires."""
+    
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.tokens = OrderedDict()  # token -> (expires, user id), least recently used first
+        self.users = OrderedDict()  # user id -> (expires, user), least recently used first
+        self.stats = {"token_hits": 0, "token_misses": 0, "user_hits": 0, "user_misses": 0, "invalidations": 0}
+    
+    def lookup(self, entries: OrderedDict, key: str):
+        entry = entries.get(key)
+        if not entry:
+            return None
+        if entry[0] <= time.monotonic():
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return entry[1]
+    
+    def store(self, entries: OrderedDict, key: str, value, ttl_seconds: float):
+        entries[key] = (time.monotonic() + ttl_seconds, value)
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+    
+    def verify_token(self, token: str) -> Optional[str]:
+        """User id of a valid token, None for invalid or expired tokens"""
+        user_id = self.lookup(self.tokens, token)
+        if user_id:
+            self.stats["token_hits"] += 1
+            return user_id
+        self.stats["token_misses"] += 1
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except jwt.InvalidTokenError:  # Includes ExpiredSignatureError
+            return None
+        user_id = payload.get("sub")
+        if user_id:
+            self.store(self.tokens, token, user_id, payload.get("exp", 0) - time.time())
+        return user_id
+    
+    async def get_user(self, user_id: str) -> Optional[dict]:
+        user = self.lookup(self.users, user_id)
+        if user:
+            self.stats["user_hits"] += 1
+        else:
+            self.stats["user_misses"] += 1
+            user = await db.users.find_one({"id": user_id})
+            if not user:
+                return None
+            self.store(self.users, user_id, user, self.ttl_seconds)
+        # Callers get their own copy, the cached record is never modified
+        return dict(user)
+    
+    def invalidate(self, user_id: str):
+        self.users.pop(user_id, None)
+        self.stats["invalidations"] += 1
+    
+    def metrics(self) -> dict:
+        token_lookups = self.stats["token_hits"] + self.stats["token_misses"]
+        user_lookups = self.stats["user_hits"] + self.stats["user_misses"]
+        return {
+            **self.stats,
+            "tokens": len(self.tokens),
+            "users": len(self.users),
+            "token_hit_rate": round(self.stats["token_hits"] / token_lookups, 3) if token_lookups else None,
+            "user_hit_rate": round(self.stats["user_hits"] / user_lookups, 3) if user_lookups else None
+        }
+
+
+user_cache = UserCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES)
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Optional[dict]:
     """Get current user from JWT token, returns None if not authenticated"""
     if not credentials:
         return None
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            return None
-        user = await db.users.find_one({"id": user_id})
-        return user
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
+    user_id = user_cache.verify_token(credentials.credentials)
+    if not user_id:
         return None
+    return await user_cache.get_user(user_id)
 
 async def require_auth(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     """Require authentication, raises 401 if not authenticated"""
@@ -113,29 +343,142 @@ async def require_auth(credentials: HTTPAuthorizationCredentials = Depends(secur
     return user
 
 
+# Title generation settings
+TITLE_SYSTEM_MESSAGE = "Du bist ein Assistent, der extrem kurze Chat-Titel erstellt. Antworte NUR mit 1-3 kurzen Wörtern, die das Thema beschreiben. Maximale Länge: 20 Zeichen. Keine Anführungszeichen, keine Erklärungen."
+TITLE_BATCH_SIZE = int(os.environ.get('TITLE_BATCH_SIZE', '8'))
+TITLE_BATCH_WAIT_SECONDS = 0.5  # How long the worker collects requests before calling the LLM
+TITLE_STREAM_WAIT_SECONDS = 15.0  # How long a chat stream waits to push the final title
+TITLE_REQUEUE_AFTER_SECONDS = 60  # Older pending titles were lost with their worker's queue
+
+def fallback_chat_title(message: str) -> str:
+    """Provisional title: first 20 chars of the message"""
+    return message[:20] + ("..." if len(message) > 20 else "")
+
+def clean_chat_title(title: str) -> str:
+    """Clean up a title returned by the LLM"""
+    title = title.strip().strip('"').strip("'")
+    if len(title) > 25:
+        title = title[:22] + "..."
+    return title
+
 async def generate_chat_title(message: str) -> str:
     """Generate a short descriptive title for a chat based on the first message"""
     try:
         chat = LlmChat(
             api_key=EMERGENT_LLM_KEY,
             session_id=f"title-{uuid.uuid4()}",
-            system_message="Du bist ein Assistent, der extrem kurze Chat-Titel erstellt. Antworte NUR mit 1-3 kurzen Wörtern, die das Thema beschreiben. Maximale Länge: 20 Zeichen. Keine Anführungszeichen, keine Erklärungen."
+            system_message=TITLE_SYSTEM_MESSAGE
         ).with_model("openai", "gpt-4o-mini")
         
         user_message = UserMessage(text=f"Erstelle einen extrem kurzen Titel (max. 20 Zeichen) für: {message[:200]}")
         title = await chat.send_message(user_message)
         
-        # Clean up the title
-        title = title.strip().strip('"').strip("'")
-        if len(title) > 25:
-            title = title[:22] + "..."
-        
-        return title
+        return clean_chat_title(title)
     except Exception as e:
         logger.error(f"Error generating title: {e}")
         # Fallback: use first 20 chars of message
-        return message[:20] + ("..." if len(message) > 20 else "")
+        return fallback_chat_title(message)
+
+async def generate_chat_titles(messages: List[str]) -> List[str]:
+    """Generate titles for several chats with a single LLM call"""
+    if len(messages) == 1:
+        return [await generate_chat_title(messages[0])]
+    try:
+        chat = LlmChat(
+            api_key=EMERGENT_LLM_KEY,
+            session_id=f"titles-{uuid.uuid4()}",
+            system_message=TITLE_SYSTEM_MESSAGE
+        ).with_model("openai", "gpt-4o-mini")
+        
+        numbered = "\n".join(f"{i + 1}. {m[:200]}" for i, m in enumerate(messages))
+        user_message = UserMessage(
+            text=f"Erstelle für jede der folgenden {len(messages)} Nachrichten einen extrem kurzen Titel (max. 20 Zeichen). "
+                 f"Antworte NUR mit einem JSON-Array aus {len(messages)} Strings in derselben Reihenfolge:\n{numbered}"
+        )
+        reply = await chat.send_message(user_message)
+        
+        titles = json.loads(reply[reply.index("["):reply.rindex("]") + 1])
+        if not isinstance(titles, list) or len(titles) != len(messages):
+            raise ValueError(f"Expected {len(messages)} titles, got: {reply[:200]}")
+        return [clean_chat_title(str(t)) or fallback_chat_title(m) for t, m in zip(titles, messages)]
+    except Exception as e:
+        logger.error(f"Error generating titles: {e}")
+        return [fallback_chat_title(m) for m in messages]
+
+
+class TitleWorker:
+    """Generates chat titles in the background.
+    
+    New conversations are stored with a provisional title and queued here. Requests
+    arriving within TITLE_BATCH_WAIT_SECONDS are batched into one LLM call, and the
+    final title is written to the conversation (unless it was renamed meanwhile)."""
+    
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.waiters = {}  # conversation_id -> Future resolving to the final title
+        self.task = None
+    
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+    
+    def request(self, conversation_id: str, source: str):
+        """Queue title generation for a conversation"""
+        self.waiters[conversation_id] = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((conversation_id, source))
+    
+    async def wait(self, conversation_id: str, timeout: float) -> Optional[str]:
+        """Wait for the final title of a queued conversation, None on timeout"""
+        future = self.waiters.get(conversation_id)
+        if not future:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+    
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + TITLE_BATCH_WAIT_SECONDS
+            while len(batch) < TITLE_BATCH_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self.process(batch)
+    
+    async def process(self, batch: list):
+        titles = {}
+        try:
+            generated = await generate_chat_titles([source for _, source in batch])
+            for (conversation_id, _), title in zip(batch, generated):
+                # Only replace the provisional title, never a user-chosen one
+                await db.conversations.update_one(
+                    {"id": conversation_id, "title_pending": True},
+                    {"$set": {"title": title, "title_pending": False}}
+                )
+                titles[conversation_id] = title
+        except Exception as e:
+            logger.error(f"Title worker error: {e}")
+        finally:
+            for conversation_id, _ in batch:
+                future = self.waiters.pop(conversation_id, None)
+                if future and not future.done():
+                    future.set_result(titles.get(conversation_id))
 
+title_worker = TitleWorker()
 
 # Define Models
 class StatusCheck(BaseModel):
@@ -169,17 +512,172 @@ class ChatRequest(BaseModel):
     conversation_id: Optional[str] = None
     session_id: Optional[str] = None
     action: Optional[str] = None
+    no_cache: bool = False  # Bypass the answer cache for this request
 
 class ChatResponse(BaseModel):
     response: str
     conversation_id: str
     message_id: str
     title: Optional[str] = None
+    title_pending: bool = False
+
+# Auth rate limiting settings: "<burst>/<seconds>", the bucket refills fully in <seconds>
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'memory')  # memory or mongo (shared by all workers)
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', '1'))  # Trusted proxies adding X-Forwarded-For
+RATE_LIMIT_MEMORY_MAX_KEYS = 100000
+RATE_LIMIT_RULES = {
+    "login_ip": os.environ.get('RATE_LIMIT_LOGIN_IP', '20/60'),
+    "login_account": os.environ.get('RATE_LIMIT_LOGIN_ACCOUNT', '5/300'),
+    "register_ip": os.environ.get('RATE_LIMIT_REGISTER_IP', '10/3600'),
+    "reset_request_ip": os.environ.get('RATE_LIMIT_RESET_REQUEST_IP', '5/900'),
+    "reset_request_account": os.environ.get('RATE_LIMIT_RESET_REQUEST_ACCOUNT', '3/900'),
+    "reset_confirm_ip": os.environ.get('RATE_LIMIT_RESET_CONFIRM_IP', '10/900'),
+    "reset_confirm_account": os.environ.get('RATE_LIMIT_RESET_CONFIRM_ACCOUNT', '5/900'),
+}
+
+
+def parse_rate_limit(value: str) -> tuple:
+    """(burst, tokens per second) of a "<burst>/<seconds>" setting"""
+    burst, seconds = value.split("/")
+    return float(burst), float(burst) / float(seconds)
+
+
+class MemoryBucketStore:
+    """Token buckets of this worker process, least recently used evicted first"""
+    
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, updated)
+    
+    async def take(self, key: str, burst: float, rate: float, now: float) -> float:
+        """Take one token; returns 0 if allowed, else seconds until a token is available"""
+        tokens, updated = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now)
+        self.buckets.move_to_end(key)
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / rate
+    
+    async def refund(self, key: str, burst: float):
+        """Give back a token taken for a request that turned out legitimate"""
+        if key in self.buckets:
+            tokens, updated = self.buckets[key]
+            self.buckets[key] = (min(burst, tokens + 1), updated)
+
+
+class MongoBucketStore:
+    """Token buckets in db.rate_limits, shared by all workers. The refill and the
+    take happen in one atomic pipeline update; idle buckets expire via a TTL index."""
+    
+    async def take(self, key: str, burst: float, rate: float, now: float) -> float:
+        update_pipeline = [
+            {"$set": {
+                "tokens": {"$min": [burst, {"$add": [
+                    {"$ifNull": ["$tokens", burst]},
+                    {"$multiply": [{"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated", now]}]}]}, rate]}
+                ]}]},
+                "updated": now,
+                "expires_at": utc_now() + timedelta(seconds=burst / rate)
+            }},
+            {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+            {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+        ]
+        for attempt in range(2):
+            try:
+                bucket = await db.rate_limits.find_one_and_update(
+                    {"_id": key}, update_pipeline, upsert=True, return_document=ReturnDocument.AFTER
+                )
+                break
+            except DuplicateKeyError:
+                # A concurrent request created the bucket first - retry as update
+                if attempt:
+                    raise
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / rate
+    
+    async def refund(self, key: str, burst: float):
+        """Give back a token taken for a request that turned out legitimate"""
+        await db.rate_limits.update_one(
+            {"_id": key},
+            [{"$set": {"tokens": {"$min": [burst, {"$add": ["$tokens", 1]}]}}}]
+        )
+
+
+class RateLimiter:
+    """Per-IP and per-account token buckets for the auth endpoints. Requests are
+    rejected before any password is hashed or user looked up, so the work an
+    attacker can cause is bounded by the bucket rates, not the request rate."""
+    
+    def __init__(self, store, rules: dict):
+        self.store = store
+        self.rules = {name: parse_rate_limit(value) for name, value in rules.items()}
+        self.stats = {name: {"allowed": 0, "rejected": 0, "refunded": 0} for name in rules}
+    
+    async def check(self, rule: str, subject: Optional[str]):
+        if not RATE_LIMIT_ENABLED or not subject:
+            return
+        burst, rate = self.rules[rule]
+        retry_after = await self.store.take(f"{rule}:{subject}", burst, rate, time.time())
+        if retry_after:
+            self.stats[rule]["rejected"] += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Zu viele Versuche. Bitte warte einen Moment und versuche es erneut.",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+        self.stats[rule]["allowed"] += 1
+    
+    async def check_request(self, request: Request, ip_rule: str, account_rule: Optional[str] = None, email: Optional[str] = None):
+        await self.check(ip_rule, client_ip(request))
+        if account_rule:
+            await self.check(account_rule, account_subject(email))
+    
+    async def refund(self, rule: str, subject: Optional[str]):
+        """Undo the charge of a request, e.g. a login that turned out successful"""
+        if not RATE_LIMIT_ENABLED or not subject:
+            return
+        await self.store.refund(f"{rule}:{subject}", self.rules[rule][0])
+        self.stats[rule]["refunded"] += 1
+    
+    def metrics(self) -> dict:
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "store": type(self.store).__name__,
+            "rules": {
+                name: {"burst": burst, "per_second": round(rate, 4), **self.stats[name]}
+                for name, (burst, rate) in self.rules.items()
+            }
+        }
+
+
+def account_subject(email: Optional[str]) -> Optional[str]:
+    """Bucket subject of an account; hashed, so the store never holds plain email addresses"""
+    return hashlib.sha256(email.lower().encode()).hexdigest() if email else None
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """Client address, taken from X-Forwarded-For as written by the trusted proxies"""
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if RATE_LIMIT_PROXY_HOPS and len(forwarded) >= RATE_LIMIT_PROXY_HOPS:
+        return forwarded[-RATE_LIMIT_PROXY_HOPS]
+    return request.client.host if request.client else None
+
+
+rate_limiter = RateLimiter(
+    MongoBucketStore() if RATE_LIMIT_STORE == "mongo" else MemoryBucketStore(RATE_LIMIT_MEMORY_MAX_KEYS),
+    RATE_LIMIT_RULES
+)
+
 
 # Auth Routes
 @api_router.post("/auth/register", response_model=TokenResponse)
-async def register(data: UserRegister):
+async def register(data: UserRegister, request: Request):
     """Register a new user"""
+    await rate_limiter.check_request(request, "register_ip")
     # Check if email already exists
     existing_user = await db.users.find_one({"email": data.email.lower()})
     if existing_user:
@@ -190,11 +688,12 @@ async def register(data: UserRegister):
     user = {
         "id": user_id,
         "email": data.email.lower(),
-        "password_hash": hash_password(data.password),
+        "password_hash": await hash_password(data.password),
         "name": data.name or data.email.split("@")[0],
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": utc_now()
     }
     await db.users.insert_one(user)
+    spawn_background(record_new_user())
     
     # Create token
     access_token = create_access_token(user_id)
@@ -205,17 +704,33 @@ async def register(data: UserRegister):
             id=user_id,
             email=user["email"],
             name=user["name"],
-            created_at=datetime.fromisoformat(user["created_at"]),
+            created_at=user["created_at"],
             bundesland=None
         )
     )
 
 @api_router.post("/auth/login", response_model=TokenResponse)
-async def login(data: UserLogin):
+async def login(data: UserLogin, request: Request):
     """Login user"""
+    await rate_limiter.check_request(request, "login_ip", "login_account", data.email)
     user = await db.users.find_one({"email": data.email.lower()})
-    if not user or not verify_password(data.password, user["password_hash"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Ungültige E-Mail oder Passwort")
+    valid, new_hash = await verify_and_update_password(data.password, user["password_hash"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Ungültige E-Mail oder Passwort")
+    if new_hash:
+        # Upgrade hashes made with an older cost factor; skipped if the password changed meanwhile
+        await db.users.update_one(
+            {"id": user["id"], "password_hash": user["password_hash"]},
+            {"$set": {"password_hash": new_hash}}
+        )
+        user_cache.invalidate(user["id"])
+        password_hasher.stats["rehashed"] += 1
+    
+    # Only failed attempts count against the account: users logging in on several
+    # devices are never throttled by their own successful logins
+    await rate_limiter.refund("login_account", account_subject(data.email))
     
     access_token = create_access_token(user["id"])
     
@@ -225,7 +740,7 @@ async def login(data: UserLogin):
             id=user["id"],
             email=user["email"],
             name=user.get("name"),
-            created_at=datetime.fromisoformat(user["created_at"]) if isinstance(user["created_at"], str) else user["created_at"],
+            created_at=as_datetime(user["created_at"]),
             bundesland=user.get("bundesland")
         )
     )
@@ -237,7 +752,7 @@ async def get_me(user: dict = Depends(require_auth)):
         id=user["id"],
         email=user["email"],
         name=user.get("name"),
-        created_at=datetime.fromisoformat(user["created_at"]) if isinstance(user["created_at"], str) else user["created_at"],
+        created_at=as_datetime(user["created_at"]),
         bundesland=user.get("bundesland")
     )
 
@@ -252,15 +767,16 @@ async def change_password(data: ChangePasswordRequest, user: dict = Depends(requ
     # Verify current password
     # We need to fetch the full user with password hash (get_current_user returns it, but let's be safe)
     db_user = await db.users.find_one({"id": user["id"]})
-    if not db_user or not verify_password(data.current_password, db_user["password_hash"]):
+    if not db_user or not await verify_password(data.current_password, db_user["password_hash"]):
         raise HTTPException(status_code=400, detail="Aktuelles Passwort ist falsch")
     
     # Update password
-    new_hash = hash_password(data.new_password)
+    new_hash = await hash_password(data.new_password)
     await db.users.update_one(
         {"id": user["id"]},
         {"$set": {"password_hash": new_hash}}
     )
+    user_cache.invalidate(user["id"])
     return {"message": "Passwort erfolgreich geändert"}
 
 @api_router.delete("/auth/me")
@@ -268,11 +784,16 @@ async def delete_account(user: dict = Depends(require_auth)):
     """Delete current user account and all data"""
     user_id = user["id"]
     
-    # Delete all conversations
+    # Delete all conversations and their messages
+    conversation_ids = await db.conversations.distinct("id", {"user_id": user_id})
     await db.conversations.delete_many({"user_id": user_id})
+    await db.messages.delete_many({"conversation_id": {"$in": conversation_ids}})
     
-    # Delete user
-    await db.users.delete_one({"id": user_id})
+    # Delete user; the stored record, not the cached one, tells which counter to decrement
+    deleted = await db.users.find_one_and_delete({"id": user_id}, projection={"_id": 0, "bundesland": 1})
+    user_cache.invalidate(user_id)
+    if deleted:
+        await update_bundesland_counts(deleted.get("bundesland"), None)
     
     return {"message": "Konto erfolgreich gelöscht"}
 
@@ -282,10 +803,17 @@ class UpdateBundeslandRequest(BaseModel):
 @api_router.patch("/auth/bundesland")
 async def update_bundesland(data: UpdateBundeslandRequest, user: dict = Depends(require_auth)):
     """Update user's bundesland preference"""
-    await db.users.update_one(
+    # The previous value comes from the same atomic write, so concurrent changes
+    # and a stale cached user cannot make the per-bundesland counters drift
+    previous = await db.users.find_one_and_update(
         {"id": user["id"]},
-        {"$set": {"bundesland": data.bundesland}}
+        {"$set": {"bundesland": data.bundesland}},
+        projection={"_id": 0, "bundesland": 1},
+        return_document=ReturnDocument.BEFORE
     )
+    user_cache.invalidate(user["id"])
+    if previous:
+        await update_bundesland_counts(previous.get("bundesland"), data.bundesland)
     return {"success": True, "bundesland": data.bundesland}
 
 
@@ -298,8 +826,9 @@ class PasswordResetConfirm(BaseModel):
     new_password: str
 
 @api_router.post("/auth/request-password-reset")
-async def request_password_reset(data: PasswordResetRequest):
+async def request_password_reset(data: PasswordResetRequest, request: Request):
     """Request a password reset - generates a 6-digit code"""
+    await rate_limiter.check_request(request, "reset_request_ip", "reset_request_account", data.email)
     user = await db.users.find_one({"email": data.email.lower()})
     if not user:
         # Don't reveal if email exists - security best practice
@@ -313,8 +842,8 @@ async def request_password_reset(data: PasswordResetRequest):
     await db.password_resets.insert_one({
         "email": data.email.lower(),
         "reset_code": reset_code,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": utc_now()
     })
     
     # In production, you would send this via email
@@ -328,8 +857,9 @@ async def request_password_reset(data: PasswordResetRequest):
     }
 
 @api_router.post("/auth/reset-password")
-async def reset_password(data: PasswordResetConfirm):
+async def reset_password(data: PasswordResetConfirm, request: Request):
     """Reset password using the reset code"""
+    await rate_limiter.check_request(request, "reset_confirm_ip", "reset_confirm_account", data.email)
     # Find valid reset request
     reset_request = await db.password_resets.find_one({
         "email": data.email.lower(),
@@ -340,21 +870,23 @@ async def reset_password(data: PasswordResetConfirm):
         raise HTTPException(status_code=400, detail="Ungültiger Reset-Code")
     
     # Check if expired
-    expires_at = datetime.fromisoformat(reset_request["expires_at"])
+    expires_at = as_datetime(reset_request["expires_at"])
     if datetime.now(timezone.utc) > expires_at:
         # Clean up expired code
         await db.password_resets.delete_one({"_id": reset_request["_id"]})
         raise HTTPException(status_code=400, detail="Reset-Code ist abgelaufen")
     
     # Update user password
-    new_hash = hash_password(data.new_password)
-    result = await db.users.update_one(
+    new_hash = await hash_password(data.new_password)
+    updated_user = await db.users.find_one_and_update(
         {"email": data.email.lower()},
-        {"$set": {"password_hash": new_hash}}
+        {"$set": {"password_hash": new_hash}},
+        projection={"_id": 0, "id": 1}
     )
     
-    if result.modified_count == 0:
+    if not updated_user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
+    user_cache.invalidate(updated_user["id"])
     
     # Delete used reset code
     await db.password_resets.delete_one({"_id": reset_request["_id"]})
@@ -371,9 +903,7 @@ async def create_status_check(input: StatusCheckCreate):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
     
-    # Convert to dict and serialize datetime to ISO string for MongoDB
     doc = status_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     
     _ = await db.status_checks.insert_one(doc)
     return status_obj
@@ -383,149 +913,1056 @@ async def get_status_checks():
     # Exclude MongoDB's _id field from the query results
     status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
     
-    # Convert ISO string timestamps back to datetime objects
+    # Older checks stored ISO string timestamps
     for check in status_checks:
-        if isinstance(check['timestamp'], str):
-            check['timestamp'] = datetime.fromisoformat(check['timestamp'])
+        check['timestamp'] = as_datetime(check['timestamp'])
     
     return status_checks
 
-# Chat endpoints
-@api_router.post("/chat", response_model=ChatResponse)
-async def send_chat_message(request: ChatRequest, user: Optional[dict] = Depends(get_current_user)):
-    """Send a message to N8N webhook and get a response"""
-    try:
-        # Generate or use existing conversation/session ID
-        conversation_id = request.conversation_id or str(uuid.uuid4())
-        session_id = request.session_id or conversation_id
+
+# Chat helpers
+# Keep references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run a coroutine in the background, independent of the current request"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+# N8N concurrency limiter settings
+N8N_MIN_CONCURRENCY = int(os.environ.get('N8N_MIN_CONCURRENCY', '2'))
+N8N_MAX_CONCURRENCY = int(os.environ.get('N8N_MAX_CONCURRENCY', '64'))
+N8N_INITIAL_CONCURRENCY = int(os.environ.get('N8N_INITIAL_CONCURRENCY', '16'))
+N8N_MAX_QUEUE = int(os.environ.get('N8N_MAX_QUEUE', '100'))
+N8N_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('N8N_QUEUE_TIMEOUT_SECONDS', '30'))
+N8N_LATENCY_TOLERANCE = 2.0  # A window whose median exceeds this multiple of the baseline counts as overload
+N8N_LATENCY_WINDOW_SECONDS = 10.0  # Also the minimum time between two decreases
+N8N_LATENCY_WINDOW_MIN_SAMPLES = 20
+N8N_BASELINE_FLOOR_SECONDS = 0.5
+N8N_DECREASE_FACTOR = 0.9
+
+class N8nSlot:
+    """Admission to call N8N; set `overloaded` when the call showed N8N is saturated.
+    `status` and `latency` are set once N8N answered; for streams the latency is
+    the time to first byte."""
+    def __init__(self, workload: str, started: float, queued_seconds: float):
+        self.workload = workload
+        self.started = started
+        self.queued_seconds = queued_seconds
+        self.overloaded = False
+        self.status = None
+        self.latency = None
+
+
+class N8nConcurrencyLimiter:
+    """Adaptive (AIMD) limit on concurrent N8N calls with a bounded FIFO wait queue.
+    
+    The limit grows by 1/limit per answered call and shrinks by N8N_DECREASE_FACTOR,
+    at most once per N8N_LATENCY_WINDOW_SECONDS, when calls time out, return 5xx
+    or the median latency of a window exceeds N8N_LATENCY_TOLERANCE times the
+    baseline of its workload. Single slow calls only skip their increase, since
+    answer length alone varies latency a lot. Workloads (chat, stream, upload, per
+    action) have separate baselines since a 180 s upload is normal where a chat is
+    not; streams are judged by time to first byte, not by how long the client
+    reads. Calls that never got a response from N8N (e.g. all breakers open) leave
+    limit and baselines alone. Requests that find the queue full, or wait longer
+    than N8N_QUEUE_TIMEOUT_SECONDS, are rejected with 503 and a Retry-After header."""
+    
+    def __init__(self, min_limit: int, max_limit: int, initial_limit: int, max_queue: int, queue_timeout: float):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiters = deque()
+        self.baseline_latency = {}  # workload -> slow EWMA of window median latencies of 2xx calls
+        self.windows = {}  # workload -> (window start, 2xx latencies so far)
+        self.last_decrease = -math.inf
+        self.stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_queue_timeout": 0,
+                      "decreases": 0, "queue_time_total": 0.0, "queue_time_max": 0.0, "queued": 0}
+    
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up"""
+        baselines = list(self.baseline_latency.values())
+        latency = sum(baselines) / len(baselines) if baselines else 10.0
+        return max(1, min(60, math.ceil(latency * (len(self.waiters) + 1) / self.limit)))
+    
+    def overloaded_error(self) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail="KI-Dienst ist ausgelastet. Bitte versuche es gleich noch einmal.",
+            headers={"Retry-After": str(self.retry_after())}
+        )
+    
+    def check_capacity(self):
+        """Fail fast if a new request would not even fit into the wait queue"""
+        if len(self.waiters) >= self.max_queue and self.in_flight >= int(self.limit):
+            self.stats["rejected_queue_full"] += 1
+            raise self.overloaded_error()
+    
+    async def acquire(self, workload: str) -> N8nSlot:
+        queued_at = time.monotonic()
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+        else:
+            self.check_capacity()
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.append(future)
+            self.stats["queued"] += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future.done() and not future.cancelled():
+                    # Slot was granted just as we gave up: hand it on
+                    self.in_flight -= 1
+                    self.wake_waiters()
+                else:
+                    future.cancel()
+                    self.waiters.remove(future)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.stats["rejected_queue_timeout"] += 1
+                raise self.overloaded_error()
         
-        # Get bundesland from user account (not from request)
-        user_bundesland = user.get("bundesland") if user else None
+        now = time.monotonic()
+        queued_seconds = now - queued_at
+        self.stats["admitted"] += 1
+        self.stats["queue_time_total"] += queued_seconds
+        self.stats["queue_time_max"] = max(self.stats["queue_time_max"], queued_seconds)
+        return N8nSlot(workload, now, queued_seconds)
+    
+    def release(self, slot: N8nSlot):
+        self.in_flight -= 1
+        now = time.monotonic()
         
-        # Prepare payload for N8N webhook
-        payload = {
-            "message": request.message,
-            "sessionId": session_id,
-            "conversationId": conversation_id,
-            "bundesland": user_bundesland
+        if slot.overloaded:
+            self.decrease(now)
+        elif slot.status is not None:
+            if slot.status < 300:
+                self.observe(slot.workload, slot.latency, now)
+            baseline = self.baseline_latency.get(slot.workload)
+            if baseline is None or slot.latency <= baseline * N8N_LATENCY_TOLERANCE:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self.wake_waiters()
+    
+    def decrease(self, now: float):
+        """Multiplicative decrease, once per window: the calls of one overload all report it"""
+        if now - self.last_decrease < N8N_LATENCY_WINDOW_SECONDS:
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * N8N_DECREASE_FACTOR)
+        self.stats["decreases"] += 1
+    
+    def observe(self, workload: str, latency: float, now: float):
+        """Collect 2xx latencies and compare each full window's median with the baseline"""
+        started, latencies = self.windows.setdefault(workload, (now, []))
+        latencies.append(latency)
+        if now - started < N8N_LATENCY_WINDOW_SECONDS or len(latencies) < N8N_LATENCY_WINDOW_MIN_SAMPLES:
+            return
+        del self.windows[workload]
+        median = statistics.median(latencies)
+        baseline = self.baseline_latency.get(workload)
+        if baseline is None:
+            self.baseline_latency[workload] = max(N8N_BASELINE_FLOOR_SECONDS, median)
+            return
+        overloaded = median > baseline * N8N_LATENCY_TOLERANCE
+        if overloaded:
+            self.decrease(now)
+        # Still moves while overloaded, so a baseline that is too low catches up with a real shift
+        weight = 0.05 if overloaded else 0.2
+        self.baseline_latency[workload] = max(N8N_BASELINE_FLOOR_SECONDS, (1 - weight) * baseline + weight * median)
+    
+    def wake_waiters(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            future = self.waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+    
+    @asynccontextmanager
+    async def slot(self, workload: str):
+        slot = await self.acquire(workload)
+        try:
+            yield slot
+        except httpx.TransportError:
+            # Timeouts and connection errors
+            slot.overloaded = True
+            raise
+        finally:
+            self.release(slot)
+    
+    def metrics(self) -> dict:
+        admitted = self.stats["admitted"]
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_length": len(self.waiters),
+            "max_queue": self.max_queue,
+            "baseline_latency_seconds": {workload: round(latency, 3) for workload, latency in self.baseline_latency.items()},
+            "queue_time_avg_seconds": round(self.stats["queue_time_total"] / admitted, 3) if admitted else 0.0,
+            **self.stats
         }
+
+n8n_limiter = N8nConcurrencyLimiter(
+    N8N_MIN_CONCURRENCY, N8N_MAX_CONCURRENCY, N8N_INITIAL_CONCURRENCY, N8N_MAX_QUEUE, N8N_QUEUE_TIMEOUT_SECONDS
+)
+
+
+# N8N routing settings
+N8N_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('N8N_BREAKER_FAILURE_THRESHOLD', '5'))
+N8N_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('N8N_BREAKER_COOLDOWN_SECONDS', '30'))
+N8N_RETRY_BUDGET_RATIO = 0.2  # At most ~20% extra requests caused by retries
+N8N_RETRY_BUDGET_MAX = 10.0
+N8N_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+class N8nEndpoint:
+    """One N8N webhook URL with passive health tracking and a circuit breaker.
+    
+    The breaker opens after N8N_BREAKER_FAILURE_THRESHOLD consecutive failures
+    (transport errors or 5xx). After N8N_BREAKER_COOLDOWN_SECONDS a single probe
+    request is let through (half-open); its outcome closes or re-opens the breaker."""
+    
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.requests = 0
+        self.failures = 0
+        self.latency_ewma = None
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= N8N_BREAKER_COOLDOWN_SECONDS:
+            return "half_open"
+        return "open"
+    
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.probe_in_flight)
+    
+    def begin(self):
+        self.outstanding += 1
+        self.requests += 1
+        if self.state == "half_open":
+            self.probe_in_flight = True
+    
+    def finish(self, success: Optional[bool], latency: float):
+        """Record the outcome of a request; None means it was abandoned by the client"""
+        self.outstanding -= 1
+        self.probe_in_flight = False
+        if success is None:
+            return
+        if success:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.opened_at is not None or self.consecutive_failures >= N8N_BREAKER_FAILURE_THRESHOLD:
+                if self.opened_at is None:
+                    logger.warning(f"N8N circuit breaker opened for {self.url}")
+                self.opened_at = time.monotonic()
+    
+    def metrics(self) -> dict:
+        return {
+            "url": self.url,
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_ewma_seconds": round(self.latency_ewma, 3) if self.latency_ewma else None
+        }
+
+
+class N8nRouter:
+    """Balances N8N calls across webhook endpoints by least outstanding requests.
+    
+    Routing rules pin requests with a given action or bundesland to dedicated
+    endpoints; those fall back to the shared pool while their breaker is open.
+    Only connect-phase failures are retried (the request never reached N8N), and
+    retries are limited by a budget that refills with N8N_RETRY_BUDGET_RATIO per
+    request, so retries cannot multiply load during an outage."""
+    
+    def __init__(self, urls: List[str], rules: List[dict]):
+        self.pool = [N8nEndpoint(url) for url in urls]
+        endpoints = {endpoint.url: endpoint for endpoint in self.pool}
+        self.rules = []
+        for rule in rules:
+            endpoint = endpoints.setdefault(rule["url"], N8nEndpoint(rule["url"]))
+            self.rules.append((rule.get("action"), rule.get("bundesland"), endpoint))
+        self.endpoints = list(endpoints.values())
+        self.retry_budget = N8N_RETRY_BUDGET_MAX
+        self.retries = 0
+    
+    def candidates(self, action: Optional[str], bundesland: Optional[str], exclude: list) -> List[N8nEndpoint]:
+        for rule_action, rule_bundesland, endpoint in self.rules:
+            if (rule_action is None or rule_action == action) and (rule_bundesland is None or rule_bundesland == bundesland):
+                if endpoint.available() and endpoint not in exclude:
+                    return [endpoint]
+                break
+        return [endpoint for endpoint in self.pool if endpoint.available() and endpoint not in exclude]
+    
+    def pick(self, action: Optional[str], bundesland: Optional[str], exclude: list) -> Optional[N8nEndpoint]:
+        candidates = self.candidates(action, bundesland, exclude)
+        if not candidates:
+            return None
+        return min(candidates, key=lambda e: (e.outstanding, e.latency_ewma or 0.0))
+    
+    async def send(self, action: Optional[str], bundesland: Optional[str], stream: bool, **kwargs) -> tuple:
+        """Send a POST to the best endpoint. Returns (response, endpoint, started)."""
+        self.retry_budget = min(N8N_RETRY_BUDGET_MAX, self.retry_budget + N8N_RETRY_BUDGET_RATIO)
+        tried = []
+        while True:
+            endpoint = self.pick(action, bundesland, tried)
+            if endpoint is None:
+                raise HTTPException(
+                    status_code=503,
+                    detail="KI-Dienst ist nicht erreichbar. Bitte versuche es später noch einmal.",
+                    headers={"Retry-After": str(int(N8N_BREAKER_COOLDOWN_SECONDS))}
+                )
+            endpoint.begin()
+            started = time.monotonic()
+            try:
+                request = http_client.build_request("POST", endpoint.url, **kwargs)
+                response = await http_client.send(request, stream=stream)
+                return response, endpoint, started
+            except N8N_CONNECT_ERRORS as e:
+                endpoint.finish(False, time.monotonic() - started)
+                tried.append(endpoint)
+                if self.retry_budget < 1 or self.pick(action, bundesland, tried) is None:
+                    raise
+                self.retry_budget -= 1
+                self.retries += 1
+                logger.warning(f"N8N connect to {endpoint.url} failed ({type(e).__name__}), retrying on another endpoint")
+            except httpx.TransportError:
+                endpoint.finish(False, time.monotonic() - started)
+                raise
+            except BaseException:
+                endpoint.finish(None, time.monotonic() - started)
+                raise
+    
+    def metrics(self) -> dict:
+        return {
+            "retries": self.retries,
+            "retry_budget": round(self.retry_budget, 2),
+            "endpoints": [endpoint.metrics() for endpoint in self.endpoints]
+        }
+
+n8n_router = N8nRouter(N8N_WEBHOOK_URLS, N8N_ROUTING_RULES)
+
+
+@asynccontextmanager
+async def n8n_request(action: Optional[str], bundesland: Optional[str], stream: bool = False, workload: str = "chat", **kwargs):
+    """POST to N8N through the concurrency limiter and router, yielding the response.
+    `workload` names the kind of call (chat, upload) for the limiter's latency baselines."""
+    async with n8n_limiter.slot(f"{workload}:{action or 'default'}:{'stream' if stream else 'full'}") as slot:
+        response, endpoint, started = await n8n_router.send(action, bundesland, stream, **kwargs)
+        # Streams return after the headers, complete calls after the whole body
+        slot.latency = time.monotonic() - slot.started
+        slot.status = response.status_code
+        slot.overloaded = response.status_code >= 500
+        success = response.status_code < 500
+        try:
+            yield response
+        except httpx.TransportError:
+            success = False
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away, which says nothing about the endpoint's health
+            success = None
+            raise
+        finally:
+            if stream:
+                await response.aclose()
+            endpoint.finish(success, time.monotonic() - started)
+
+
+async def post_to_n8n(action: Optional[str], bundesland: Optional[str], workload: str = "chat", **kwargs) -> httpx.Response:
+    """POST to N8N and read the complete response"""
+    async with n8n_request(action, bundesland, workload=workload, **kwargs) as response:
+        return response
+
+
+# Idempotency settings
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '600'))  # 10 minutes
+IDEMPOTENCY_MAX_ENTRIES = 10000
+
+class IdempotencyStore:
+    """Honours Idempotency-Key headers for the chat endpoints.
+    
+    Concurrent requests with the same key join the single in-flight N8N call, and
+    completed results are replayed for IDEMPOTENCY_TTL_SECONDS. Failures are not
+    stored, so a retry after an error runs again."""
+    
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.in_flight = {}  # key -> (fingerprint, Task)
+        self.results = {}  # key -> (fingerprint, result, timestamp)
+    
+    def purge_expired(self):
+        now = time.monotonic()
+        # Entries are stored in insertion order, so expired ones are at the front
+        for key in list(self.results):
+            if now - self.results[key][2] < self.ttl_seconds and len(self.results) <= self.max_entries:
+                break
+            del self.results[key]
+    
+    async def run(self, key: str, fingerprint: str, call) -> tuple:
+        """Run `call` once per key. Returns (result, replayed)."""
+        self.purge_expired()
         
-        # Add action field if provided
-        if request.action:
-            payload["action"] = request.action
-        
-        logger.info(f"Sending message to N8N webhook: {request.message[:50]}...")
-        
-        # Call N8N webhook
-        # Use global client
-        response = await http_client.post(
-            N8N_WEBHOOK_URL,
-            json=payload,
-            headers={"Content-Type": "application/json"}
-        )
+        if key in self.results:
+            stored_fingerprint, result, _ = self.results[key]
+            self.check_fingerprint(stored_fingerprint, fingerprint)
+            return result, True
         
-        logger.info(f"N8N response status: {response.status_code}")
-        logger.info(f"N8N response body: {response.text[:500]}")
+        if key in self.in_flight:
+            stored_fingerprint, task = self.in_flight[key]
+            self.check_fingerprint(stored_fingerprint, fingerprint)
+            return await asyncio.shield(task), True
         
-        if response.status_code != 200:
-            logger.error(f"N8N webhook error: {response.text}")
+        # Run as a task so a disconnecting client does not cancel it for joined requests
+        task = asyncio.ensure_future(call())
+        self.in_flight[key] = (fingerprint, task)
+        try:
+            result = await asyncio.shield(task)
+            self.results[key] = (fingerprint, result, time.monotonic())
+            return result, False
+        finally:
+            if task.done():
+                self.in_flight.pop(key, None)
+            else:
+                task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+    
+    @staticmethod
+    def check_fingerprint(stored_fingerprint: str, fingerprint: str):
+        if stored_fingerprint != fingerprint:
             raise HTTPException(
-                status_code=502,
-                detail=f"N8N webhook returned error: {response.status_code}"
+                status_code=409,
+                detail="Idempotency-Key wurde bereits für eine andere Anfrage verwendet"
             )
-        
-        # Parse response - handle different possible formats
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES)
+
+
+def idempotency_scope(idempotency_key: str, endpoint: str, user: Optional[dict]) -> str:
+    """Scope keys per user and endpoint so clients cannot replay each other's results"""
+    return f"{user['id'] if user else 'guest'}:{endpoint}:{idempotency_key}"
+
+
+def request_fingerprint(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def extract_ai_response(response_data) -> str:
+    """Extract the assistant text from the different N8N response formats"""
+    # Lists carry the answer in their first item
+    if isinstance(response_data, list) and len(response_data) > 0:
+        response_data = response_data[0]
+    if isinstance(response_data, str):
+        return response_data
+    if isinstance(response_data, dict):
+        return (
+            response_data.get('response') or 
+            response_data.get('output') or 
+            response_data.get('message') or 
+            response_data.get('text') or
+            response_data.get('answer') or
+            str(response_data)
+        )
+    return str(response_data)
+
+
+def parse_n8n_response(response: httpx.Response) -> str:
+    """Parse a complete N8N webhook response, falling back to plain text"""
+    try:
+        return extract_ai_response(response.json())
+    except Exception:
+        # If not JSON, use plain text
+        return response.text
+
+
+async def store_chat_exchange(conversation_id: str, user: Optional[dict], user_msg: dict, assistant_msg: dict, title_source: str) -> tuple:
+    """Append a user/assistant message pair to a conversation, creating it if needed.
+    Returns (title, title_pending). New conversations get a provisional title while
+    the final one is generated by the title worker.
+    
+    The conversation document is updated with a single atomic upsert that also
+    reserves the sequence numbers of the two messages, which are then inserted into
+    db.messages. It is written as an update pipeline because claiming a guest
+    conversation for a logged-in user needs a conditional; $ifNull plays the role of
+    $setOnInsert. The provisional title is wrapped in $literal so text starting with
+    "$" is not read as a field path.
+    
+    message_count and message_bytes are maintained in the same update, so readers
+    never have to count or measure the messages themselves."""
+    now = utc_now()
+    provisional_title = fallback_chat_title(title_source)
+    added_bytes = message_size(user_msg) + message_size(assistant_msg)
+    
+    # Get user_id if authenticated
+    user_id = user["id"] if user else None
+    
+    update_pipeline = [{"$set": {
+        "id": conversation_id,
+        "message_count": {"$add": [legacy_message_count_expr(), 2]},
+        # Conversations from before the byte counter stay without it until backfill_message_bytes
+        "message_bytes": {"$switch": {
+            "branches": [
+                {"case": {"$eq": [{"$type": "$created_at"}, "missing"]}, "then": added_bytes},
+                {"case": {"$eq": [{"$type": "$message_bytes"}, "missing"]}, "then": "$$REMOVE"}
+            ],
+            "default": {"$add": ["$message_bytes", added_bytes]}
+        }},
+        "last_message": {"$literal": message_snippet(assistant_msg["content"])},
+        "updated_at": now,
+        # Associate guest conversations with the user once they are logged in
+        "user_id": {"$ifNull": ["$user_id", user_id]},
+        "title": {"$ifNull": ["$title", {"$literal": provisional_title}]},
+        "title_pending": {"$cond": [
+            {"$eq": [{"$type": "$created_at"}, "missing"]}, True, "$title_pending"
+        ]},
+        "created_at": {"$ifNull": ["$created_at", now]}
+    }}]
+    
+    for attempt in range(2):
         try:
-            response_data = response.json()
-            
-            # Try different response formats
-            if isinstance(response_data, str):
-                ai_response = response_data
-            elif isinstance(response_data, dict):
-                ai_response = (
-                    response_data.get('response') or 
-                    response_data.get('output') or 
-                    response_data.get('message') or 
-                    response_data.get('text') or
-                    response_data.get('answer') or
-                    str(response_data)
-                )
-            elif isinstance(response_data, list) and len(response_data) > 0:
-                first_item = response_data[0]
-                if isinstance(first_item, str):
-                    ai_response = first_item
-                elif isinstance(first_item, dict):
-                    ai_response = (
-                        first_item.get('response') or 
-                        first_item.get('output') or 
-                        first_item.get('message') or 
-                        first_item.get('text') or
-                        first_item.get('answer') or
-                        str(first_item)
+            conversation = await db.conversations.find_one_and_update(
+                {"id": conversation_id},
+                update_pipeline,
+                projection={"_id": 0, "title": 1, "title_pending": 1, "message_count": 1, "created_at": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            # A concurrent request created the conversation first - retry as update
+            if attempt:
+                raise
+    
+    seq = conversation["message_count"] - 1
+    await db.messages.insert_many([
+        {**user_msg, "conversation_id": conversation_id, "seq": seq},
+        {**assistant_msg, "conversation_id": conversation_id, "seq": seq + 1}
+    ])
+    
+    created = conversation["created_at"] == now
+    if created:
+        # Conversation was created: generate the final title in the background
+        title_worker.request(conversation_id, title_source)
+    spawn_background(record_chat_activity(user_id, user.get("bundesland") if user else None, created))
+    return conversation.get("title"), conversation.get("title_pending", False)
+
+
+# Message history settings
+MESSAGE_PAGE_MAX_LIMIT = 100
+MESSAGE_MIGRATION_BATCH_SIZE = 100
+MESSAGE_SNIPPET_LENGTH = 100
+
+def message_snippet(content: str) -> str:
+    """Short single-line preview of a message for the sidebar"""
+    content = " ".join((content or "").split())
+    return content[:MESSAGE_SNIPPET_LENGTH] + ("..." if len(content) > MESSAGE_SNIPPET_LENGTH else "")
+
+def message_size(message: dict) -> int:
+    """Size of a message's content in UTF-8 bytes, as counted in message_bytes"""
+    return len((message.get("content") or "").encode("utf-8"))
+
+
+def legacy_message_count_expr() -> dict:
+    """Aggregation expression for the message count of a conversation that may still
+    embed its messages (written before messages moved to db.messages)"""
+    return {"$ifNull": ["$message_count", {"$size": {"$ifNull": ["$messages", []]}}]}
+
+
+async def load_messages(conversation: dict, before: Optional[int] = None, limit: Optional[int] = None) -> tuple:
+    """Load messages of a conversation in ascending seq order.
+    With `limit`, returns the latest `limit` messages older than `before`.
+    Returns (messages, has_more)."""
+    # Not yet migrated conversations embed their first messages (seq 1..n)
+    legacy = [{**m, "seq": i} for i, m in enumerate(conversation.get("messages") or [], start=1)]
+    query = {"conversation_id": conversation["id"], "seq": {"$gt": len(legacy)}}
+    projection = {"_id": 0, "conversation_id": 0}
+    
+    if legacy:
+        messages = legacy + await db.messages.find(query, projection).sort("seq", 1).to_list(None)
+        if before is not None:
+            messages = [m for m in messages if m["seq"] < before]
+        if limit is None:
+            return messages, False
+        return messages[-limit:], len(messages) > limit
+    
+    if before is not None:
+        query["seq"]["$lt"] = before
+    if limit is None:
+        return await db.messages.find(query, projection).sort("seq", 1).to_list(None), False
+    page = await db.messages.find(query, projection).sort("seq", -1).to_list(limit + 1)
+    has_more = len(page) > limit
+    return list(reversed(page[:limit])), has_more
+
+
+async def ensure_indexes():
+    """Create all indexes of DB_INDEXES. Existing indexes are left untouched, and a
+    failing index (e.g. duplicates blocking a unique index) does not stop the others."""
+    for collection, indexes in DB_INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection].create_indexes([index])
+            except OperationFailure as e:
+                logger.error(f"Could not create index {collection}.{index.document['name']}: {e}")
+
+
+async def migrate_embedded_messages():
+    """Move messages embedded in conversation documents into db.messages.
+    Idempotent and resumable: each conversation is migrated with upserts and only
+    loses its embedded array once all of its messages are stored. Pages by _id, so
+    each batch continues where the previous one ended instead of rescanning."""
+    migrated = 0
+    last_id = None
+    while True:
+        query = {"messages": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db.conversations.find(
+            query,
+            {"_id": 1, "id": 1, "messages": 1}
+        ).sort("_id", 1).to_list(MESSAGE_MIGRATION_BATCH_SIZE)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+        for conversation in batch:
+            messages = conversation["messages"]
+            if messages:
+                await db.messages.bulk_write([
+                    UpdateOne(
+                        {"conversation_id": conversation["id"], "seq": seq},
+                        {"$setOnInsert": {**message, "conversation_id": conversation["id"], "seq": seq}},
+                        upsert=True
                     )
-                else:
-                    ai_response = str(first_item)
-            else:
-                ai_response = str(response_data)
-                
-        except Exception as json_err:
-            # If not JSON, use plain text
-            ai_response = response.text
-        
-        message_id = str(uuid.uuid4())
-        
-        # Store conversation in database
-        user_msg = {
-            "id": str(uuid.uuid4()),
-            "role": "user",
-            "content": request.message,
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        }
+                    for seq, message in enumerate(messages, start=1)
+                ], ordered=False)
+            # New messages were already numbered after the embedded ones, so the count never shrinks
+            await db.conversations.update_one(
+                {"id": conversation["id"]},
+                [
+                    {"$set": {
+                        "message_count": {"$max": [{"$ifNull": ["$message_count", 0]}, len(messages)]},
+                        "last_message": {"$ifNull": [
+                            "$last_message",
+                            {"$literal": message_snippet(messages[-1]["content"]) if messages else None}
+                        ]}
+                    }},
+                    {"$unset": "messages"}
+                ]
+            )
+            migrated += 1
+    if migrated:
+        logger.info(f"Migrated messages of {migrated} conversation(s) to the messages collection")
+
+# Timestamp fields stored as ISO strings before the switch to native BSON dates
+TIMESTAMP_FIELDS = {
+    "users": ["created_at"],
+    "conversations": ["created_at", "updated_at"],
+    "messages": ["timestamp"],
+    "password_resets": ["created_at", "expires_at"],
+    "feedback": ["created_at"],
+    "chat_jobs": ["created_at", "updated_at"],
+    "status_checks": ["timestamp"],
+}
+TIMESTAMP_MIGRATION_BATCH_SIZE = 500
+
+async def migrate_timestamps():
+    """Convert ISO string timestamps to native dates in batches.
+    Resumable: each run only picks up documents that still hold strings, paging by
+    _id so every document is visited once. Every update is conditional on the old
+    value, so concurrent writes are never overwritten. Unparseable values are
+    logged and left as they are."""
+    for collection, fields in TIMESTAMP_FIELDS.items():
+        converted = 0
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        last_id = None
+        while True:
+            page_query = {**query, "_id": {"$gt": last_id}} if last_id is not None else query
+            batch = await db[collection].find(page_query, {field: 1 for field in fields}).sort("_id", 1).to_list(TIMESTAMP_MIGRATION_BATCH_SIZE)
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            operations = []
+            for doc in batch:
+                for field in fields:
+                    value = doc.get(field)
+                    if isinstance(value, str):
+                        try:
+                            parsed = as_datetime(value)
+                        except ValueError:
+                            logger.error(f"Unparseable timestamp {collection}.{field} in {doc['_id']}: {value!r}")
+                            continue
+                        operations.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: parsed}}))
+            if operations:
+                result = await db[collection].bulk_write(operations, ordered=False)
+                converted += result.modified_count
+        if converted:
+            logger.info(f"Converted {converted} timestamp(s) in {collection}")
+
+
+async def backfill_message_bytes():
+    """Set message_bytes on conversations created before the counter existed.
+    The sum is only written if all message_count messages were found and no message
+    was appended meanwhile; other conversations are picked up by the next run."""
+    filled = skipped = 0
+    last_id = ""
+    while True:
+        batch = await db.conversations.find(
+            {"message_bytes": {"$exists": False}, "id": {"$gt": last_id}},
+            {"_id": 0, "id": 1, "message_count": 1}
+        ).sort("id", 1).to_list(MESSAGE_MIGRATION_BATCH_SIZE)
+        if not batch:
+            break
+        last_id = batch[-1]["id"]
+        ids = [conversation["id"] for conversation in batch]
+        sizes = {}
+        async for item in db.messages.aggregate([
+            {"$match": {"conversation_id": {"$in": ids}}},
+            {"$group": {
+                "_id": "$conversation_id",
+                "count": {"$sum": 1},
+                "bytes": {"$sum": {"$strLenBytes": {"$ifNull": ["$content", ""]}}}
+            }}
+        ]):
+            sizes[item["_id"]] = item
+        operations = []
+        for conversation in batch:
+            count = conversation.get("message_count", 0)
+            size = sizes.get(conversation["id"], {"count": 0, "bytes": 0})
+            if size["count"] != count:
+                skipped += 1
+                continue
+            operations.append(UpdateOne(
+                {"id": conversation["id"], "message_count": count, "message_bytes": {"$exists": False}},
+                {"$set": {"message_bytes": size["bytes"]}}
+            ))
+        if operations:
+            result = await db.conversations.bulk_write(operations, ordered=False)
+            filled += result.modified_count
+    if filled or skipped:
+        logger.info(f"Backfilled message_bytes of {filled} conversation(s), {skipped} left for the next run")
+
+
+async def requeue_pending_titles():
+    """Queue title generation again for conversations whose title is still pending.
+    The title worker's queue lives in memory, so a restart or crash loses it."""
+    cutoff = utc_now() - timedelta(seconds=TITLE_REQUEUE_AFTER_SECONDS)
+    requeued = 0
+    async for conversation in db.conversations.find(
+        {"title_pending": True, "created_at": {"$lt": cutoff}},
+        {"_id": 0, "id": 1, "title": 1}
+    ):
+        first = await db.messages.find_one(
+            {"conversation_id": conversation["id"], "role": "user"},
+            {"_id": 0, "content": 1},
+            sort=[("seq", 1)]
+        )
+        title_worker.request(conversation["id"], (first or {}).get("content") or conversation.get("title") or "")
+        requeued += 1
+    if requeued:
+        logger.info(f"Requeued title generation for {requeued} conversation(s)")
+
+
+async def run_migrations():
+    """Background data migrations, in order"""
+    await requeue_pending_titles()
+    await migrate_embedded_messages()
+    await migrate_timestamps()
+    await backfill_message_bytes()
+    # Admin stats only read rollups: build them from history until a past day exists
+    if not await db.daily_stats.find_one({"day": {"$lt": day_key(utc_now())}}, {"_id": 1}):
+        await backfill_daily_stats()
+
+# Answer cache settings (opt-in)
+ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE_ENABLED', 'false').lower() == 'true'
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get('ANSWER_CACHE_TTL_SECONDS', str(24 * 3600)))
+ANSWER_CACHE_MAX_BYTES = int(os.environ.get('ANSWER_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+ANSWER_CACHE_MAX_ENTRY_BYTES = 256 * 1024
+# Near duplicates may differ in wording only: a different number or term can change
+# the legal answer, so the tier is off unless explicitly enabled
+ANSWER_CACHE_NEAR_DUP_ENABLED = os.environ.get('ANSWER_CACHE_NEAR_DUP_ENABLED', 'false').lower() == 'true'
+ANSWER_CACHE_NEAR_DUP_THRESHOLD = float(os.environ.get('ANSWER_CACHE_NEAR_DUP_THRESHOLD', '0.95'))
+# Words that may differ between near duplicates; any other differing word is a miss
+NEAR_DUP_FILLER_WORDS = frozenset(
+    "bitte mal denn eigentlich doch ja eben halt genau noch kurz gerne hallo hi danke "
+    "ich wir man du sie mir uns mich kannst könntest können kann würde würdest "
+    "der die das den dem des ein eine einen einem einer und oder also so".split()
+)
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # 16 bands x 4 rows for locality-sensitive lookup
+MINHASH_SHINGLE_WORDS = 2  # Word bigrams
+MINHASH_PRIME = (1 << 61) - 1
+MINHASH_SEEDS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], "big") % (MINHASH_PRIME - 1) + 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], "big") % MINHASH_PRIME)
+    for i in range(MINHASH_PERMUTATIONS)
+]
+
+
+def normalize_question(text: str) -> str:
+    """Normalize a question for cache lookups: case, unicode form, punctuation, whitespace"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def number_tokens(text: str) -> tuple:
+    """All numbers of a normalized text in order; near duplicates must agree on them"""
+    return tuple(re.findall(r"\d+", text))
+
+
+def minhash_signature(text: str) -> tuple:
+    """MinHash signature over the word bigrams of a normalized text, filler words skipped"""
+    words = [word for word in text.split() if word not in NEAR_DUP_FILLER_WORDS] or [""]
+    shingles = {" ".join(words[i:i + MINHASH_SHINGLE_WORDS]) for i in range(max(1, len(words) - MINHASH_SHINGLE_WORDS + 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(sh.encode(), digest_size=8).digest(), "big") for sh in shingles]
+    return tuple(min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in MINHASH_SEEDS)
+
+
+class AnswerCache:
+    """Caches N8N answers to the first question of a conversation.
+    
+    Two tiers: exact matches on (normalized text, bundesland, action) and, if
+    enabled, near duplicates found via MinHash/LSH over word bigrams within the same
+    bundesland and action. A near duplicate must contain exactly the same numbers
+    and may only differ in filler words (NEAR_DUP_FILLER_WORDS), so "16 m" never
+    gets the answer for "10 m" and "Gewerbegebiet" never the one for "Wohngebiet".
+    Entries are evicted least-recently-used when ANSWER_CACHE_MAX_BYTES is
+    exceeded and expire after ANSWER_CACHE_TTL_SECONDS."""
+    
+    def __init__(self, ttl_seconds: int, max_bytes: int, near_dup_threshold: float, near_dup_enabled: bool):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.near_dup_threshold = near_dup_threshold
+        self.near_dup_enabled = near_dup_enabled
+        self.entries = OrderedDict()  # key -> entry dict, least recently used first
+        self.buckets = {}  # (scope, band, band values) -> set of keys
+        self.bytes = 0
+        self.stats = {"exact_hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0}
+    
+    def bands(self, scope: tuple, signature: tuple):
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        for band in range(MINHASH_BANDS):
+            yield (scope, band, signature[band * rows:(band + 1) * rows])
+    
+    def get(self, message: str, bundesland: Optional[str], action: Optional[str]) -> Optional[str]:
+        normalized = normalize_question(message)
+        scope = (bundesland, action)
+        key = (normalized, scope)
         
-        assistant_msg = {
-            "id": message_id,
-            "role": "assistant", 
-            "content": ai_response,
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        }
+        entry = self.lookup(key)
+        if entry:
+            self.stats["exact_hits"] += 1
+            return entry["answer"]
+        if not self.near_dup_enabled:
+            self.stats["misses"] += 1
+            return None
         
-        # Check if conversation exists
-        existing_conv = await db.conversations.find_one({"id": conversation_id})
+        # Near-duplicate tier: compare with LSH candidates from the same scope
+        signature = minhash_signature(normalized)
+        numbers = number_tokens(normalized)
+        words = frozenset(normalized.split())
+        candidates = set()
+        for bucket in self.bands(scope, signature):
+            candidates |= self.buckets.get(bucket, set())
+        best_key, best_similarity = None, 0.0
+        for candidate in candidates:
+            candidate_entry = self.entries.get(candidate)
+            if not candidate_entry or candidate_entry["numbers"] != numbers:
+                continue
+            if not (words ^ candidate_entry["words"]) <= NEAR_DUP_FILLER_WORDS:
+                continue
+            similarity = sum(x == y for x, y in zip(signature, candidate_entry["signature"])) / MINHASH_PERMUTATIONS
+            if similarity > best_similarity:
+                best_key, best_similarity = candidate, similarity
+        if best_key and best_similarity >= self.near_dup_threshold:
+            entry = self.lookup(best_key)
+            if entry:
+                self.stats["near_hits"] += 1
+                return entry["answer"]
         
-        # Get user_id if authenticated
-        user_id = user["id"] if user else None
+        self.stats["misses"] += 1
+        return None
+    
+    def lookup(self, key: tuple) -> Optional[dict]:
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        if time.monotonic() - entry["created"] >= self.ttl_seconds:
+            self.stats["expirations"] += 1
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+    
+    def put(self, message: str, bundesland: Optional[str], action: Optional[str], answer: str):
+        normalized = normalize_question(message)
+        scope = (bundesland, action)
+        key = (normalized, scope)
+        size = len(answer.encode()) + 2 * len(normalized.encode()) + 8 * MINHASH_PERMUTATIONS
+        if size > ANSWER_CACHE_MAX_ENTRY_BYTES:
+            return
+        if key in self.entries:
+            self.remove(key)
         
-        if existing_conv:
-            # Update existing conversation
-            update_data = {
-                "$push": {"messages": {"$each": [user_msg, assistant_msg]}},
-                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-            }
-            # If user is now logged in, associate the conversation with them
-            if user_id and not existing_conv.get("user_id"):
-                update_data["$set"]["user_id"] = user_id
-            
-            await db.conversations.update_one({"id": conversation_id}, update_data)
-            response_title = existing_conv.get("title")
-        else:
-            # Create new conversation with AI-generated title
-            generated_title = await generate_chat_title(request.message)
-            new_conv = {
-                "id": conversation_id,
-                "user_id": user_id,  # None for guests, user_id for logged in users
-                "title": generated_title,
-                "messages": [user_msg, assistant_msg],
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.conversations.insert_one(new_conv)
-            response_title = generated_title
+        signature = minhash_signature(normalized)
+        self.entries[key] = {
+            "answer": answer,
+            "signature": signature,
+            "numbers": number_tokens(normalized),
+            "words": frozenset(normalized.split()),
+            "size": size,
+            "created": time.monotonic()
+        }
+        for bucket in self.bands(scope, signature):
+            self.buckets.setdefault(bucket, set()).add(key)
+        self.bytes += size
+        self.stats["stores"] += 1
         
-        return ChatResponse(
-            response=ai_response,
-            conversation_id=conversation_id,
+        while self.bytes > self.max_bytes and self.entries:
+            self.remove(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+    
+    def remove(self, key: tuple):
+        entry = self.entries.pop(key)
+        self.bytes -= entry["size"]
+        for bucket in self.bands(key[1], entry["signature"]):
+            keys = self.buckets.get(bucket)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.buckets[bucket]
+    
+    def clear(self):
+        self.entries.clear()
+        self.buckets.clear()
+        self.bytes = 0
+    
+    def metrics(self) -> dict:
+        lookups = self.stats["exact_hits"] + self.stats["near_hits"] + self.stats["misses"]
+        hits = self.stats["exact_hits"] + self.stats["near_hits"]
+        return {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "near_dup_enabled": self.near_dup_enabled,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            **self.stats
+        }
+
+answer_cache = AnswerCache(
+    ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_BYTES, ANSWER_CACHE_NEAR_DUP_THRESHOLD, ANSWER_CACHE_NEAR_DUP_ENABLED
+)
+
+
+def is_answer_cacheable(request: ChatRequest) -> bool:
+    """Only first messages of new conversations are stateless enough to share answers.
+    Note that a cache hit never reaches N8N, so its session memory lacks that turn."""
+    return ANSWER_CACHE_ENABLED and not request.no_cache and not request.conversation_id
+
+def build_chat_payload(request: ChatRequest, user: Optional[dict], conversation_id: str) -> dict:
+    """Build the JSON payload sent to the N8N webhook for a text message"""
+    # Get bundesland from user account (not from request)
+    user_bundesland = user.get("bundesland") if user else None
+    
+    payload = {
+        "message": request.message,
+        "sessionId": request.session_id or conversation_id,
+        "conversationId": conversation_id,
+        "bundesland": user_bundesland
+    }
+    
+    # Add action field if provided
+    if request.action:
+        payload["action"] = request.action
+    return payload
+
+
+# Chat endpoints
+async def process_chat_message(request: ChatRequest, user: Optional[dict]) -> ChatResponse:
+    """Send a message to N8N webhook and get a response"""
+    try:
+        # Generate or use existing conversation ID
+        conversation_id = request.conversation_id or str(uuid.uuid4())
+        
+        # Prepare payload for N8N webhook
+        payload = build_chat_payload(request, user, conversation_id)
+        
+        use_cache = is_answer_cacheable(request)
+        ai_response = answer_cache.get(request.message, payload["bundesland"], request.action) if use_cache else None
+        
+        if ai_response is not None:
+            logger.info(f"Answer cache hit: {request.message[:50]}...")
+        else:
+            logger.info(f"Sending message to N8N webhook: {request.message[:50]}...")
+            
+            # Call N8N webhook
+            response = await post_to_n8n(
+                request.action,
+                payload["bundesland"],
+                json=payload,
+                headers={"Content-Type": "application/json"}
+            )
+            
+            logger.info(f"N8N response status: {response.status_code}")
+            logger.info(f"N8N response body: {response.text[:500]}")
+            
+            if response.status_code != 200:
+                logger.error(f"N8N webhook error: {response.text}")
+                raise HTTPException(
+                    status_code=502,
+                    detail=f"N8N webhook returned error: {response.status_code}"
+                )
+            
+            # Parse response - handle different possible formats
+            ai_response = parse_n8n_response(response)
+            
+            # Generated images are served from short-lived URLs and must not be shared
+            if use_cache and ai_response and "imageUrl" not in ai_response:
+                answer_cache.put(request.message, payload["bundesland"], request.action, ai_response)
+        
+        message_id = str(uuid.uuid4())
+        
+        # Store conversation in database
+        user_msg = {
+            "id": str(uuid.uuid4()),
+            "role": "user",
+            "content": request.message,
+            "timestamp": utc_now()
+        }
+        
+        assistant_msg = {
+            "id": message_id,
+            "role": "assistant", 
+            "content": ai_response,
+            "timestamp": utc_now()
+        }
+        
+        response_title, title_pending = await store_chat_exchange(conversation_id, user, user_msg, assistant_msg, request.message)
+        
+        return ChatResponse(
+            response=ai_response,
+            conversation_id=conversation_id,
             message_id=message_id,
-            title=response_title
+            title=response_title,
+            title_pending=title_pending
         )
         
     except httpx.TimeoutException:
@@ -534,11 +1971,170 @@ async def send_chat_message(request: ChatRequest, user: Optional[dict] = Depends
     except httpx.RequestError as e:
         logger.error(f"N8N webhook request error: {str(e)}")
         raise HTTPException(status_code=502, detail=f"Failed to connect to N8N: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@api_router.post("/chat", response_model=ChatResponse)
+async def send_chat_message(
+    request: ChatRequest,
+    response: Response,
+    user: Optional[dict] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Send a message to N8N webhook and get a response"""
+    if not idempotency_key:
+        return await process_chat_message(request, user)
+    
+    result, replayed = await idempotency_store.run(
+        idempotency_scope(idempotency_key, "chat", user),
+        request_fingerprint(request.model_dump()),
+        lambda: process_chat_message(request, user)
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+# N8N stream chunk types that carry no content
+N8N_STREAM_CONTROL_TYPES = ("begin", "end", "error")
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+
+def parse_n8n_stream_line(line: str) -> Optional[str]:
+    """Parse one line of a streamed N8N response.
+    N8N streams newline-delimited JSON objects like {"type": "item", "content": "..."}.
+    Returns the content for items, "" for control lines and None if the line is not
+    part of an N8N stream (e.g. a workflow that answers with a plain JSON body)."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or "type" not in data:
+        return None
+    if data["type"] == "item":
+        return data.get("content") or ""
+    if data["type"] in N8N_STREAM_CONTROL_TYPES:
+        if data["type"] == "error":
+            logger.error(f"N8N stream error: {data.get('content')}")
+        return ""
+    return None
+
+
+@api_router.post("/chat/stream")
+async def stream_chat_message(request: ChatRequest, user: Optional[dict] = Depends(get_current_user)):
+    """Send a message to N8N webhook and relay the response as Server-Sent Events.
+    
+    Events: `start` (ids), `token` (content chunk), `done` (title) or `error` (detail).
+    The assembled answer is stored in the conversation when the stream closes. For new
+    conversations a final `title` event follows once the generated title is ready."""
+    conversation_id = request.conversation_id or str(uuid.uuid4())
+    payload = build_chat_payload(request, user, conversation_id)
+    message_id = str(uuid.uuid4())
+    
+    # Reject with a proper 503 before the SSE response has started
+    n8n_limiter.check_capacity()
+    
+    user_msg = {
+        "id": str(uuid.uuid4()),
+        "role": "user",
+        "content": request.message,
+        "timestamp": utc_now()
+    }
+    
+    def build_assistant_msg(chunks: List[str]) -> dict:
+        return {
+            "id": message_id,
+            "role": "assistant",
+            "content": "".join(chunks),
+            "timestamp": utc_now()
+        }
+    
+    async def event_stream():
+        chunks = []
+        # Lines that are not N8N stream items (workflow without streaming enabled)
+        raw_lines = []
+        
+        yield sse_event("start", {"conversation_id": conversation_id, "message_id": message_id})
+        
+        try:
+            logger.info(f"Streaming message to N8N webhook: {request.message[:50]}...")
+            async with n8n_request(
+                request.action,
+                payload["bundesland"],
+                stream=True,
+                json=payload,
+                headers={"Content-Type": "application/json"}
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    logger.error(f"N8N webhook error: {response.text}")
+                    yield sse_event("error", {"detail": f"N8N webhook returned error: {response.status_code}"})
+                    return
+                
+                async for line in response.aiter_lines():
+                    chunk = parse_n8n_stream_line(line)
+                    if chunk is None:
+                        if line.strip():
+                            raw_lines.append(line)
+                    elif chunk:
+                        chunks.append(chunk)
+                        yield sse_event("token", {"content": chunk})
+            
+            if not chunks and raw_lines:
+                # Non-streaming workflow: relay the complete answer at once
+                raw_body = "\n".join(raw_lines)
+                try:
+                    content = extract_ai_response(json.loads(raw_body))
+                except ValueError:
+                    content = raw_body
+                chunks.append(content)
+                yield sse_event("token", {"content": content})
+        except httpx.TimeoutException:
+            logger.error("N8N webhook timeout")
+            yield sse_event("error", {"detail": "N8N webhook timeout"})
+            return
+        except httpx.RequestError as e:
+            logger.error(f"N8N webhook request error: {str(e)}")
+            yield sse_event("error", {"detail": f"Failed to connect to N8N: {str(e)}"})
+            return
+        except HTTPException as e:
+            # No free N8N slot in time or no healthy N8N endpoint
+            yield sse_event("error", {"detail": e.detail})
+            return
+        except BaseException:
+            # Client disconnected mid-stream: keep the partial answer
+            if chunks:
+                spawn_background(store_chat_exchange(conversation_id, user, user_msg, build_assistant_msg(chunks), request.message))
+            raise
+        
+        title, title_pending = await asyncio.shield(
+            store_chat_exchange(conversation_id, user, user_msg, build_assistant_msg(chunks), request.message)
+        )
+        yield sse_event("done", {
+            "conversation_id": conversation_id,
+            "message_id": message_id,
+            "title": title,
+            "title_pending": title_pending
+        })
+        
+        if title_pending:
+            final_title = await title_worker.wait(conversation_id, TITLE_STREAM_WAIT_SECONDS)
+            if final_title:
+                yield sse_event("title", {"conversation_id": conversation_id, "title": final_title})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # File upload constants
 MAX_FILE_SIZE = 25 * 1024 * 1024  # 25 MB per file
 MAX_FILES = 5  # Maximum 5 files
@@ -547,67 +2143,357 @@ ALLOWED_AUDIO_TYPES = ["audio/webm", "audio/mp4", "audio/mpeg", "audio/wav", "au
 ALLOWED_FILE_TYPES = ALLOWED_IMAGE_TYPES + ["application/pdf"] + ALLOWED_AUDIO_TYPES
 
 
-@api_router.post("/chat/upload", response_model=ChatResponse)
-async def send_chat_with_files(
-    message: str = Form(""),
-    conversation_id: Optional[str] = Form(None),
-    session_id: Optional[str] = Form(None),
-    action: Optional[str] = Form(None),
-    files: List[UploadFile] = File(...),
-    user: Optional[dict] = Depends(get_current_user)
-):
-    """Send a message with multiple files (images, PDFs, or audio) to N8N webhook"""
-    try:
-        # Validate number of files
-        if len(files) > MAX_FILES:
+UPLOAD_PATHS = ("/api/chat/upload", "/api/chat/upload/jobs")
+UPLOAD_PART_OVERHEAD = 16 * 1024  # Allowance for the part headers of a file
+UPLOAD_MAX_FIELDS = 8  # Text fields next to the files
+UPLOAD_MAX_BODY_SIZE = MAX_FILES * (MAX_FILE_SIZE + UPLOAD_PART_OVERHEAD) + 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Files are streamed to N8N in chunks of this size
+UPLOAD_SPOOL_MAX_SIZE = 1024 * 1024  # Job copies of uploads above this size go to disk
+
+
+# Counters of UploadLimitMiddleware, which Starlette instantiates itself
+upload_limit_stats = {"checked": 0, "rejected": 0, "rejected_declared": 0, "rejected_bytes": 0}
+
+
+def upload_limit_metrics() -> dict:
+    return {
+        **upload_limit_stats,
+        "max_body_bytes": UPLOAD_MAX_BODY_SIZE,
+        "max_file_bytes": MAX_FILE_SIZE,
+        "max_files": MAX_FILES
+    }
+
+
+class UploadLimitMiddleware:
+    """Rejects oversized upload requests while the body streams in.
+    
+    Requests to UPLOAD_PATHS with a larger Content-Length are rejected before any
+    byte is read. Otherwise the body is counted as it arrives, and multipart
+    boundaries are tracked to find single parts above MAX_FILE_SIZE and more parts
+    than allowed. On a violation a 413 is sent right away and the application sees a
+    client disconnect, which aborts the multipart parse; the server then closes the
+    connection instead of reading the rest."""
+    
+    def __init__(self, app):
+        self.app = app
+        self.stats = upload_limit_stats
+    
+    async def reject(self, scope, receive, send, detail: str):
+        self.stats["rejected"] += 1
+        response = JSONResponse({"detail": detail}, status_code=413, headers={"Connection": "close"})
+        await response(scope, receive, send)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in UPLOAD_PATHS:
+            await self.app(scope, receive, send)
+            return
+        self.stats["checked"] += 1
+        headers = dict(scope["headers"])
+        
+        declared = headers.get(b"content-length")
+        if declared and declared.isdigit() and int(declared) > UPLOAD_MAX_BODY_SIZE:
+            self.stats["rejected_declared"] += 1
+            await self.reject(scope, receive, send, f"Upload zu groß. Maximum: {UPLOAD_MAX_BODY_SIZE // (1024*1024)} MB")
+            return
+        
+        boundary = re.search(rb'boundary="?([^";]+)"?', headers.get(b"content-type", b""))
+        delimiter = b"\r\n--" + boundary.group(1) if boundary else None
+        state = {"received": 0, "parts": 0, "part_start": 0, "tail": b"\r\n", "offset": -2,
+                 "rejected": False, "response_started": False}
+        
+        def violation(chunk: bytes) -> Optional[str]:
+            state["received"] += len(chunk)
+            if state["received"] > UPLOAD_MAX_BODY_SIZE:
+                return f"Upload zu groß. Maximum: {UPLOAD_MAX_BODY_SIZE // (1024*1024)} MB"
+            if not delimiter:
+                return None
+            # The tail is shorter than the delimiter, so no delimiter is found twice
+            data = state["tail"] + chunk
+            end = state["offset"] + len(data)
+            boundaries = []
+            position = data.find(delimiter)
+            while position != -1:
+                boundaries.append(state["offset"] + position)
+                position = data.find(delimiter, position + 1)
+            state["tail"] = data[-(len(delimiter) - 1):]
+            state["offset"] = end - len(state["tail"])
+            
+            # Every part ending in this chunk, then the part still streaming
+            for boundary_position in boundaries + [end]:
+                if boundary_position - state["part_start"] > MAX_FILE_SIZE + UPLOAD_PART_OVERHEAD:
+                    return f"Datei zu groß. Maximum: {MAX_FILE_SIZE // (1024*1024)} MB"
+                if boundary_position != end:
+                    state["part_start"] = boundary_position
+                    state["parts"] += 1
+            if state["parts"] > MAX_FILES + UPLOAD_MAX_FIELDS + 1:  # +1 for the closing delimiter
+                return f"Zu viele Dateien. Maximum: {MAX_FILES}"
+            return None
+        
+        async def limited_receive():
+            if state["rejected"]:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                detail = violation(message.get("body", b""))
+                if detail:
+                    state["rejected"] = True
+                    self.stats["rejected_bytes"] += state["received"]
+                    if not state["response_started"]:
+                        await self.reject(scope, receive, send, detail)
+                    return {"type": "http.disconnect"}
+            return message
+        
+        async def guarded_send(message):
+            if state["rejected"]:
+                return  # Our 413 was sent instead
+            if message["type"] == "http.response.start":
+                state["response_started"] = True
+            await send(message)
+        
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # The application failing on the simulated disconnect is expected
+            if not state["rejected"]:
+                raise
+
+
+async def upload_size(file: UploadFile) -> int:
+    """Size of an upload, measured in chunks if the parser did not record it.
+    Measuring stops as soon as MAX_FILE_SIZE is exceeded."""
+    if file.size is not None:
+        return file.size
+    size = 0
+    await file.seek(0)
+    while size <= MAX_FILE_SIZE:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+    await file.seek(0)
+    return size
+
+
+async def prepare_upload_files(files: List[UploadFile]) -> List[dict]:
+    """Validate uploaded files without reading them into memory.
+    The files stay in Starlette's spooled temp files and are streamed to N8N later."""
+    # Validate number of files
+    if len(files) > MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Zu viele Dateien. Maximum: {MAX_FILES}"
+        )
+    
+    processed_files = []
+    
+    for file in files:
+        # Validate file type
+        if file.content_type not in ALLOWED_FILE_TYPES:
             raise HTTPException(
                 status_code=400,
-                detail=f"Zu viele Dateien. Maximum: {MAX_FILES}"
+                detail=f"Dateityp nicht erlaubt für '{file.filename}'. Erlaubt sind: Bilder (JPEG, PNG, GIF, WebP), PDF und Audio"
             )
         
-        processed_files = []
+        # Validate file size
+        size = await upload_size(file)
+        if size > MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Datei '{file.filename}' zu groß. Maximum: {MAX_FILE_SIZE // (1024*1024)} MB"
+            )
         
-        for file in files:
-            # Validate file type
-            if file.content_type not in ALLOWED_FILE_TYPES:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Dateityp nicht erlaubt für '{file.filename}'. Erlaubt sind: Bilder (JPEG, PNG, GIF, WebP), PDF und Audio"
-                )
-            
-            # Read file content
-            file_content = await file.read()
-            
-            # Validate file size
-            if len(file_content) > MAX_FILE_SIZE:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Datei '{file.filename}' zu groß. Maximum: {MAX_FILE_SIZE // (1024*1024)} MB"
-                )
-            
-            # Convert to base64
-            file_base64 = base64.b64encode(file_content).decode('utf-8')
-            
-            # Determine file type
-            is_image = file.content_type in ALLOWED_IMAGE_TYPES
-            is_audio = file.content_type in ALLOWED_AUDIO_TYPES
-            if is_image:
-                file_type = "image"
-            elif is_audio:
-                file_type = "audio"
-            else:
-                file_type = "pdf"
-            
-            processed_files.append({
-                "name": file.filename,
-                "type": file.content_type,
-                "fileType": file_type,
-                "data": file_base64,
-                "size": len(file_content),
-                "is_image": is_image,
-                "is_audio": is_audio
-            })
+        # Determine file type
+        is_image = file.content_type in ALLOWED_IMAGE_TYPES
+        is_audio = file.content_type in ALLOWED_AUDIO_TYPES
+        if is_image:
+            file_type = "image"
+        elif is_audio:
+            file_type = "audio"
+        else:
+            file_type = "pdf"
         
+        processed_files.append({
+            "name": file.filename,
+            "type": file.content_type,
+            "fileType": file_type,
+            "upload": file,
+            "size": size,
+            "is_image": is_image,
+            "is_audio": is_audio
+        })
+    
+    return processed_files
+
+
+async def detach_upload_files(processed_files: List[dict]) -> List[dict]:
+    """Copy uploads into temp files owned by the caller, chunk by chunk.
+    Needed when the files are used after the request ended and Starlette closed them."""
+    detached = []
+    try:
+        for f in processed_files:
+            copy = UploadFile(tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_SIZE), filename=f["name"])
+            detached.append({**f, "upload": copy})
+            await f["upload"].seek(0)
+            while True:
+                chunk = await f["upload"].read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await copy.write(chunk)
+    except BaseException:
+        await close_upload_files(detached)
+        raise
+    return detached
+
+
+async def close_upload_files(processed_files: List[dict]):
+    for f in processed_files:
+        await f["upload"].close()
+
+
+def multipart_quote(value: str) -> bytes:
+    """Escape a multipart header parameter like browsers (and httpx) do"""
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A").encode("utf-8")
+
+
+class MultipartUpload:
+    """multipart/form-data request body that streams upload files in UPLOAD_CHUNK_SIZE
+    chunks, so memory per request stays constant whatever the file sizes.
+    
+    The length is known upfront and sent as Content-Length. Every iteration starts
+    the files from the beginning, so the body can be sent again when the N8N
+    router retries on another endpoint."""
+    
+    def __init__(self, fields: dict, files: List[tuple]):
+        self.boundary = uuid.uuid4().hex
+        self.parts = []  # (part header, bytes or processed file)
+        for name, value in fields.items():
+            head = f'--{self.boundary}\r\nContent-Disposition: form-data; name="'.encode() + multipart_quote(name) + b'"\r\n\r\n'
+            self.parts.append((head, value.encode("utf-8")))
+        for name, f in files:
+            head = (
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="'.encode() + multipart_quote(name)
+                + b'"; filename="' + multipart_quote(f["name"] or name) + b'"\r\n'
+                + f'Content-Type: {f["type"]}\r\n\r\n'.encode()
+            )
+            self.parts.append((head, f))
+        self.end = f"--{self.boundary}--\r\n".encode()
+        self.content_length = len(self.end) + sum(
+            len(head) + (len(body) if isinstance(body, bytes) else body["size"]) + 2
+            for head, body in self.parts
+        )
+    
+    @property
+    def headers(self) -> dict:
+        return {
+            "Content-Type": f"multipart/form-data; boundary={self.boundary}",
+            "Content-Length": str(self.content_length)
+        }
+    
+    async def __aiter__(self):
+        for head, body in self.parts:
+            yield head
+            if isinstance(body, bytes):
+                yield body
+            else:
+                upload = body["upload"]
+                await upload.seek(0)
+                sent = 0
+                while True:
+                    chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sent += len(chunk)
+                    # The size was validated upfront; enforce it while streaming as well
+                    if sent > body["size"]:
+                        raise ValueError(f"Datei '{body['name']}' wurde während des Uploads verändert")
+                    yield chunk
+                if sent != body["size"]:
+                    raise ValueError(f"Datei '{body['name']}' wurde während des Uploads verändert")
+            yield b"\r\n"
+        yield self.end
+
+
+# Thumbnail settings
+THUMBNAIL_MAX_DIMENSION = int(os.environ.get('THUMBNAIL_MAX_DIMENSION', '320'))
+THUMBNAIL_FORMAT = os.environ.get('THUMBNAIL_FORMAT', 'WEBP').upper()  # WEBP or JPEG
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', '80'))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '2'))
+THUMBNAIL_ID_PATTERN = re.compile(r"^[0-9a-f]{40}$")
+
+thumbnail_pool = None  # Process pool, created at startup
+thumbnail_stats = {"generated": 0, "reused": 0, "failed": 0}
+
+
+async def store_thumbnail(path: str, digest: bytes) -> Optional[str]:
+    """Create the thumbnail of the image at path and store it in db.thumbnails.
+    Thumbnails are content-addressed: identical images share one thumbnail, which
+    is only generated once. The temp file is removed afterwards. Returns the
+    thumbnail id, or None if the image could not be read."""
+    settings = f"{THUMBNAIL_MAX_DIMENSION}:{THUMBNAIL_FORMAT}:{THUMBNAIL_QUALITY}"
+    thumbnail_id = hashlib.sha256(digest + settings.encode()).hexdigest()[:40]
+    try:
+        if await db.thumbnails.count_documents({"_id": thumbnail_id}, limit=1):
+            thumbnail_stats["reused"] += 1
+            return thumbnail_id
+        thumbnail, width, height = await asyncio.get_running_loop().run_in_executor(
+            thumbnail_pool, make_thumbnail, path, THUMBNAIL_MAX_DIMENSION, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY
+        )
+        await db.thumbnails.update_one(
+            {"_id": thumbnail_id},
+            {"$setOnInsert": {
+                "data": thumbnail,
+                "content_type": f"image/{THUMBNAIL_FORMAT.lower()}",
+                "width": width,
+                "height": height,
+                "created_at": utc_now()
+            }},
+            upsert=True
+        )
+    except Exception as e:
+        # The message is stored without a thumbnail rather than failing the chat
+        thumbnail_stats["failed"] += 1
+        logger.warning(f"Thumbnail generation failed: {type(e).__name__} - {str(e)}")
+        return None
+    finally:
+        await asyncio.to_thread(os.unlink, path)
+    thumbnail_stats["generated"] += 1
+    return thumbnail_id
+
+
+async def start_thumbnail(f: dict) -> Optional[asyncio.Task]:
+    """Copy an uploaded image chunk by chunk into a temp file the worker process
+    opens by path, and generate its thumbnail in the background"""
+    if not f["is_image"]:
+        return None
+    upload = f["upload"]
+    digest = hashlib.sha256()
+    copy = UploadFile(tempfile.NamedTemporaryFile(prefix="thumb-", delete=False))
+    try:
+        await upload.seek(0)
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            await copy.write(chunk)
+    except BaseException:
+        await copy.close()
+        await asyncio.to_thread(os.unlink, copy.file.name)
+        raise
+    await copy.close()
+    return spawn_background(store_thumbnail(copy.file.name, digest.digest()))
+
+
+async def process_chat_with_files(
+    message: str,
+    conversation_id: Optional[str],
+    session_id: Optional[str],
+    action: Optional[str],
+    processed_files: List[dict],
+    user: Optional[dict]
+) -> ChatResponse:
+    """Send a message with multiple files (images, PDFs, or audio) to N8N webhook"""
+    try:
         # Generate or use existing conversation/session ID
         conv_id = conversation_id or str(uuid.uuid4())
         sess_id = session_id or conv_id
@@ -656,16 +2542,15 @@ async def send_chat_with_files(
         if action:
             form_data["action"] = action
         
-        # Binary files for N8N $binary access
-        # Format: (filename, content_bytes, content_type)
-        files_for_upload = []
-        for i, f in enumerate(processed_files):
-            file_key = f"file{i+1}" if i > 0 else "file"
-            # Decode base64 back to bytes for binary upload
-            file_bytes = base64.b64decode(f["data"])
-            files_for_upload.append(
-                (file_key, (f["name"], file_bytes, f["type"]))
-            )
+        # Binary files for N8N $binary access, streamed from the upload temp files
+        files_for_upload = [
+            (f"file{i+1}" if i > 0 else "file", f)
+            for i, f in enumerate(processed_files)
+        ]
+        body = MultipartUpload(form_data, files_for_upload)
+        
+        # Thumbnails are generated in the process pool while N8N works on the files
+        thumbnail_tasks = [await start_thumbnail(f) for f in processed_files]
         
         log_message = message[:50] if message else f"({len(processed_files)} Dateien)"
         logger.info(f"Sending {len(processed_files)} file(s) as binary to N8N webhook: {log_message}...")
@@ -673,13 +2558,15 @@ async def send_chat_with_files(
             logger.info(f"File: {f['name']}, Type: {f['fileType']}, Size: {f['size']} bytes")
         
         logger.info(f"Form data keys: {list(form_data.keys())}")
-        logger.info(f"Binary files: {[f[0] for f in files_for_upload]}")
+        logger.info(f"Binary files: {[name for name, _ in files_for_upload]}")
         
         # Call N8N webhook with multipart/form-data (binary files)
-        response = await http_client.post(
-            N8N_WEBHOOK_URL,
-            data=form_data,
-            files=files_for_upload,
+        response = await post_to_n8n(
+            action,
+            user_bundesland,
+            content=body,
+            headers=body.headers,
+            workload="upload",
             timeout=180.0  # Extended timeout for multiple file processing
         )
         
@@ -693,53 +2580,24 @@ async def send_chat_with_files(
             )
         
         # Parse response
-        try:
-            response_data = response.json()
-            if isinstance(response_data, str):
-                ai_response = response_data
-            elif isinstance(response_data, dict):
-                ai_response = (
-                    response_data.get('response') or 
-                    response_data.get('output') or 
-                    response_data.get('message') or 
-                    response_data.get('text') or
-                    response_data.get('answer') or
-                    str(response_data)
-                )
-            elif isinstance(response_data, list) and len(response_data) > 0:
-                first_item = response_data[0]
-                if isinstance(first_item, str):
-                    ai_response = first_item
-                elif isinstance(first_item, dict):
-                    ai_response = (
-                        first_item.get('response') or 
-                        first_item.get('output') or 
-                        first_item.get('message') or 
-                        first_item.get('text') or
-                        first_item.get('answer') or
-                        str(first_item)
-                    )
-                else:
-                    ai_response = str(first_item)
-            else:
-                ai_response = str(response_data)
-        except Exception:
-            ai_response = response.text
+        ai_response = parse_n8n_response(response)
         
         message_id = str(uuid.uuid4())
         
         # Store file infos for display (only store metadata, not full base64 for large files)
         file_infos = []
-        for f in processed_files:
+        for f, thumbnail_task in zip(processed_files, thumbnail_tasks):
             file_info = {
                 "name": f["name"],
                 "type": f["type"],
                 "fileType": f["fileType"],
                 "size": f["size"]
             }
-            # For images, store a smaller preview (only for images under 500KB)
-            if f["is_image"] and f["size"] <= 500 * 1024:
-                file_info["preview"] = f["data"]
+            # For images, reference the thumbnail instead of embedding image data
+            thumbnail_id = await thumbnail_task if thumbnail_task else None
+            if thumbnail_id:
+                file_info["thumbnail_id"] = thumbnail_id
+                file_info["thumbnail_url"] = f"/api/files/{thumbnail_id}/thumb"
             file_infos.append(file_info)
         
         # Store conversation in database
@@ -747,7 +2605,7 @@ async def send_chat_with_files(
             "id": str(uuid.uuid4()),
             "role": "user",
             "content": message,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": utc_now(),
             "files": file_infos  # Array of files
         }
         
@@ -755,45 +2613,19 @@ async def send_chat_with_files(
             "id": message_id,
             "role": "assistant",
             "content": ai_response,
-            "timestamp": datetime.now(timezone.utc).isoformat()
+            "timestamp": utc_now()
         }
         
-        # Check if conversation exists
-        existing_conv = await db.conversations.find_one({"id": conv_id})
-        
-        # Get user_id if authenticated
-        user_id = user["id"] if user else None
-        
-        if existing_conv:
-            update_data = {
-                "$push": {"messages": {"$each": [user_msg, assistant_msg]}},
-                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-            }
-            if user_id and not existing_conv.get("user_id"):
-                update_data["$set"]["user_id"] = user_id
-            
-            await db.conversations.update_one({"id": conv_id}, update_data)
-            response_title = existing_conv.get("title")
-        else:
-            # Use filename for title if no message provided
-            title_source = message if message.strip() else (processed_files[0]["name"] if len(processed_files) == 1 else f"{len(processed_files)} Dateien")
-            generated_title = await generate_chat_title(title_source)
-            new_conv = {
-                "id": conv_id,
-                "user_id": user_id,
-                "title": generated_title,
-                "messages": [user_msg, assistant_msg],
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.conversations.insert_one(new_conv)
-            response_title = generated_title
+        # Use filename for title if no message provided
+        title_source = message if message.strip() else (processed_files[0]["name"] if len(processed_files) == 1 else f"{len(processed_files)} Dateien")
+        response_title, title_pending = await store_chat_exchange(conv_id, user, user_msg, assistant_msg, title_source)
         
         return ChatResponse(
             response=ai_response,
             conversation_id=conv_id,
             message_id=message_id,
-            title=response_title
+            title=response_title,
+            title_pending=title_pending
         )
         
     except httpx.TimeoutException as e:
@@ -808,6 +2640,221 @@ async def send_chat_with_files(
         logger.error(f"Chat with file error: {type(e).__name__} - {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/chat/upload", response_model=ChatResponse)
+async def send_chat_with_files(
+    response: Response,
+    message: str = Form(""),
+    conversation_id: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    action: Optional[str] = Form(None),
+    files: List[UploadFile] = File(...),
+    user: Optional[dict] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Send a message with multiple files (images, PDFs, or audio) to N8N webhook"""
+    async def run():
+        processed_files = await prepare_upload_files(files)
+        return await process_chat_with_files(message, conversation_id, session_id, action, processed_files, user)
+    
+    if not idempotency_key:
+        return await run()
+    
+    # Files are identified by name, type and size to avoid reading them twice
+    file_fingerprints = [(f.filename, f.content_type, f.size) for f in files]
+    result, replayed = await idempotency_store.run(
+        idempotency_scope(idempotency_key, "chat/upload", user),
+        request_fingerprint(message, conversation_id, session_id, action, file_fingerprints),
+        run
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+@api_router.get("/files/{thumbnail_id}/thumb")
+async def get_thumbnail(thumbnail_id: str, if_none_match: Optional[str] = Header(None)):
+    """Serve an image thumbnail. Ids are content hashes, so thumbnails never change
+    and may be cached for a year."""
+    if not THUMBNAIL_ID_PATTERN.match(thumbnail_id):
+        raise HTTPException(status_code=404, detail="Vorschaubild nicht gefunden")
+    etag = f'"{thumbnail_id}"'
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag}
+    if if_none_match and etag in if_none_match:
+        return Response(status_code=304, headers=headers)
+    thumbnail = await db.thumbnails.find_one({"_id": thumbnail_id})
+    if not thumbnail:
+        raise HTTPException(status_code=404, detail="Vorschaubild nicht gefunden")
+    return Response(content=thumbnail["data"], media_type=thumbnail["content_type"], headers=headers)
+
+
+# Chat job settings
+CHAT_JOB_MAX_CONCURRENCY = int(os.environ.get('CHAT_JOB_MAX_CONCURRENCY', '20'))
+CHAT_JOB_STALE_SECONDS = 15 * 60  # Many missed heartbeats: the worker must have died
+CHAT_JOB_HEARTBEAT_SECONDS = 60
+CHAT_JOB_POLL_SECONDS = 2.0
+CHAT_JOB_FINAL_STATES = ("completed", "failed")
+
+class ChatJobManager:
+    """Runs slow N8N workflows (image editing, multi-PDF uploads) as background jobs.
+    
+    Job state lives in db.chat_jobs so clients can poll it from any instance. The
+    N8N call runs in a background task bounded by CHAT_JOB_MAX_CONCURRENCY and
+    stores its result in the conversation like the synchronous endpoints do."""
+    
+    def __init__(self, max_concurrency: int):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.events = {}  # job_id -> Event set when a local job finishes
+    
+    async def submit(self, kind: str, conversation_id: str, user: Optional[dict], run) -> dict:
+        now = utc_now()
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "user_id": user["id"] if user else None,
+            "conversation_id": conversation_id,
+            "status": "queued",
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        await db.chat_jobs.insert_one(job)
+        job.pop("_id", None)
+        self.events[job["id"]] = asyncio.Event()
+        spawn_background(self.execute(job["id"], run))
+        return job
+    
+    async def set_status(self, job_id: str, status: str, **fields):
+        await db.chat_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": status, "updated_at": utc_now(), **fields}}
+        )
+    
+    async def heartbeat(self, job_id: str):
+        """Keep updated_at fresh while the job is queued or running, so polls on
+        other instances don't take a job waiting for the semaphore for a dead one"""
+        while True:
+            await asyncio.sleep(CHAT_JOB_HEARTBEAT_SECONDS)
+            await db.chat_jobs.update_one(
+                {"id": job_id, "status": {"$nin": list(CHAT_JOB_FINAL_STATES)}},
+                {"$set": {"updated_at": utc_now()}}
+            )
+    
+    async def execute(self, job_id: str, run):
+        heartbeat = asyncio.create_task(self.heartbeat(job_id))
+        try:
+            async with self.semaphore:
+                await self.set_status(job_id, "running")
+                result = await run()
+                await self.set_status(job_id, "completed", result=result.model_dump())
+        except HTTPException as e:
+            await self.set_status(job_id, "failed", error={"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Chat job {job_id} failed: {type(e).__name__} - {str(e)}")
+            await self.set_status(job_id, "failed", error={"status_code": 500, "detail": str(e)})
+        finally:
+            heartbeat.cancel()
+            event = self.events.pop(job_id, None)
+            if event:
+                event.set()
+    
+    async def get(self, job_id: str, user: Optional[dict]) -> dict:
+        job = await db.chat_jobs.find_one({"id": job_id}, {"_id": 0})
+        if not job:
+            raise HTTPException(status_code=404, detail="Job nicht gefunden")
+        if job.get("user_id") and (not user or job["user_id"] != user["id"]):
+            raise HTTPException(status_code=403, detail="Zugriff verweigert")
+        
+        # Jobs whose worker died (e.g. restart) would otherwise stay running forever
+        if job["status"] not in CHAT_JOB_FINAL_STATES and job_id not in self.events:
+            if (utc_now() - as_datetime(job["updated_at"])).total_seconds() > CHAT_JOB_STALE_SECONDS:
+                error = {"status_code": 500, "detail": "Job wurde unterbrochen"}
+                # Conditional, so a job that finished or sent a heartbeat meanwhile is kept
+                update = await db.chat_jobs.update_one(
+                    {"id": job_id, "status": job["status"], "updated_at": job["updated_at"]},
+                    {"$set": {"status": "failed", "error": error, "updated_at": utc_now()}}
+                )
+                if update.modified_count:
+                    job.update(status="failed", error=error)
+                else:
+                    job = await db.chat_jobs.find_one({"id": job_id}, {"_id": 0})
+        return job
+    
+    async def wait(self, job_id: str, timeout: float):
+        """Wait until a local job finishes or the timeout passes"""
+        event = self.events.get(job_id)
+        try:
+            if event:
+                await asyncio.wait_for(event.wait(), timeout)
+            else:
+                await asyncio.sleep(timeout)
+        except asyncio.TimeoutError:
+            pass
+
+chat_jobs = ChatJobManager(CHAT_JOB_MAX_CONCURRENCY)
+
+
+@api_router.post("/chat/jobs", status_code=202)
+async def submit_chat_job(request: ChatRequest, user: Optional[dict] = Depends(get_current_user)):
+    """Submit a message as a background job and return the job id immediately"""
+    # Fix the conversation id now so the client can open the chat right away
+    request = request.model_copy(update={"conversation_id": request.conversation_id or str(uuid.uuid4())})
+    return await chat_jobs.submit("chat", request.conversation_id, user, lambda: process_chat_message(request, user))
+
+@api_router.post("/chat/upload/jobs", status_code=202)
+async def submit_chat_upload_job(
+    message: str = Form(""),
+    conversation_id: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    action: Optional[str] = Form(None),
+    files: List[UploadFile] = File(...),
+    user: Optional[dict] = Depends(get_current_user)
+):
+    """Submit a message with files as a background job and return the job id immediately"""
+    # Files are closed when the request ends, so the job gets its own temp file copies
+    processed_files = await detach_upload_files(await prepare_upload_files(files))
+    conv_id = conversation_id or str(uuid.uuid4())
+    
+    async def run():
+        try:
+            return await process_chat_with_files(message, conv_id, session_id, action, processed_files, user)
+        finally:
+            await close_upload_files(processed_files)
+    
+    return await chat_jobs.submit("upload", conv_id, user, run)
+
+@api_router.get("/chat/jobs/{job_id}")
+async def get_chat_job(job_id: str, user: Optional[dict] = Depends(get_current_user)):
+    """Poll the state of a chat job. `result` holds the chat response once completed."""
+    return await chat_jobs.get(job_id, user)
+
+@api_router.get("/chat/jobs/{job_id}/events")
+async def subscribe_chat_job(job_id: str, user: Optional[dict] = Depends(get_current_user)):
+    """Subscribe to a chat job as Server-Sent Events: `status` on changes, then `done`"""
+    job = await chat_jobs.get(job_id, user)
+    
+    async def event_stream():
+        current = job
+        last_status = None
+        while True:
+            if current["status"] in CHAT_JOB_FINAL_STATES:
+                yield sse_event("done", current)
+                return
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield sse_event("status", {"id": job_id, "status": last_status})
+            else:
+                # Comment line keeps proxies from closing the idle connection
+                yield ": keepalive\n\n"
+            await chat_jobs.wait(job_id, CHAT_JOB_POLL_SECONDS)
+            current = await chat_jobs.get(job_id, user)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.get("/conversations")
 async def get_conversations(user: dict = Depends(require_auth)):
     """Get all conversations for the logged-in user"""
@@ -815,30 +2862,133 @@ async def get_conversations(user: dict = Depends(require_auth)):
         {"user_id": user["id"]}, 
         {"_id": 0}
     ).sort("updated_at", -1).to_list(25)
+    
+    # Attach the messages of all conversations with a single query
+    stored = await db.messages.find(
+        {"conversation_id": {"$in": [c["id"] for c in conversations]}},
+        {"_id": 0}
+    ).sort([("conversation_id", 1), ("seq", 1)]).to_list(None)
+    by_conversation = {}
+    for message in stored:
+        by_conversation.setdefault(message.pop("conversation_id"), []).append(message)
+    for conversation in conversations:
+        legacy = [{**m, "seq": i} for i, m in enumerate(conversation.get("messages") or [], start=1)]
+        conversation["messages"] = legacy + [m for m in by_conversation.get(conversation["id"], []) if m["seq"] > len(legacy)]
     return conversations
 
+# Sidebar listing settings
+CONVERSATION_SUMMARY_DEFAULT_LIMIT = 25
+CONVERSATION_SUMMARY_MAX_LIMIT = 100
+
+def encode_summary_cursor(conversation: dict) -> str:
+    updated_at = conversation["updated_at"]
+    # Remember whether the value is a legacy ISO string, those sort after native dates
+    legacy = isinstance(updated_at, str)
+    cursor = [updated_at if legacy else updated_at.isoformat(), conversation["id"], legacy]
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+def decode_summary_cursor(cursor: str) -> tuple:
+    try:
+        updated_at, conversation_id, legacy = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (updated_at if legacy else as_datetime(updated_at)), conversation_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Ungültiger Cursor")
+
+@api_router.get("/conversations/summaries")
+async def get_conversation_summaries(
+    cursor: Optional[str] = None,
+    limit: int = CONVERSATION_SUMMARY_DEFAULT_LIMIT,
+    user: dict = Depends(require_auth)
+):
+    """Get a page of lightweight conversation summaries for the sidebar, newest first.
+    Pass `next_cursor` from the response to load the next page."""
+    limit = max(1, min(limit, CONVERSATION_SUMMARY_MAX_LIMIT))
+    query = {"user_id": user["id"]}
+    if cursor:
+        # Keyset pagination on (updated_at, id): strictly after the last item of the previous page
+        updated_at, conversation_id = decode_summary_cursor(cursor)
+        query["$or"] = [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "id": {"$lt": conversation_id}}
+        ]
+        if isinstance(updated_at, datetime):
+            # Not yet migrated ISO strings sort after all dates
+            query["$or"].append({"updated_at": {"$type": "string"}})
+    
+    summaries = await db.conversations.find(
+        query,
+        {
+            "_id": 0,
+            "id": 1,
+            "title": 1,
+            "title_pending": 1,
+            "updated_at": 1,
+            "message_count": legacy_message_count_expr(),
+            "message_bytes": 1,
+            "last_message": 1
+        }
+    ).sort([("updated_at", -1), ("id", -1)]).to_list(limit + 1)
+    
+    has_more = len(summaries) > limit
+    summaries = summaries[:limit]
+    return {
+        "conversations": summaries,
+        "next_cursor": encode_summary_cursor(summaries[-1]) if has_more else None
+    }
+
 @api_router.get("/conversations/{conversation_id}")
-async def get_conversation(conversation_id: str, user: Optional[dict] = Depends(get_current_user)):
-    """Get a specific conversation"""
+async def get_conversation(
+    conversation_id: str,
+    before: Optional[int] = None,
+    limit: Optional[int] = None,
+    user: Optional[dict] = Depends(get_current_user)
+):
+    """Get a specific conversation.
+    
+    Without `limit` all messages are returned. With `limit`, only the latest page of
+    messages older than the `before` cursor (a message seq) is returned; pass
+    `next_before` from the response to load the previous page."""
     conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0})
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     # Check if user has access (either their conversation or guest conversation)
     if conversation.get("user_id") and (not user or conversation["user_id"] != user["id"]):
         raise HTTPException(status_code=403, detail="Zugriff verweigert")
+    
+    if limit is not None:
+        limit = max(1, min(limit, MESSAGE_PAGE_MAX_LIMIT))
+    messages, has_more = await load_messages(conversation, before, limit)
+    conversation["messages"] = messages
+    if limit is not None:
+        conversation["has_more"] = has_more
+        conversation["next_before"] = messages[0]["seq"] if has_more else None
     return conversation
 
+@api_router.get("/conversations/{conversation_id}/title")
+async def get_conversation_title(conversation_id: str, user: Optional[dict] = Depends(get_current_user)):
+    """Get the title of a conversation, for polling while title_pending is true"""
+    conversation = await db.conversations.find_one(
+        {"id": conversation_id},
+        {"_id": 0, "user_id": 1, "title": 1, "title_pending": 1}
+    )
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if conversation.get("user_id") and (not user or conversation["user_id"] != user["id"]):
+        raise HTTPException(status_code=403, detail="Zugriff verweigert")
+    return {"title": conversation.get("title"), "title_pending": conversation.get("title_pending", False)}
+
 @api_router.delete("/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str, user: dict = Depends(require_auth)):
     """Delete a conversation"""
     # Only allow deleting own conversations
-    conversation = await db.conversations.find_one({"id": conversation_id})
+    conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0, "user_id": 1})
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if conversation.get("user_id") != user["id"]:
         raise HTTPException(status_code=403, detail="Zugriff verweigert")
     
     await db.conversations.delete_one({"id": conversation_id})
+    await db.messages.delete_many({"conversation_id": conversation_id})
     return {"message": "Conversation deleted"}
 
 
@@ -850,7 +3000,7 @@ class ConversationUpdate(BaseModel):
 async def rename_conversation(conversation_id: str, update: ConversationUpdate, user: dict = Depends(require_auth)):
     """Rename a conversation"""
     # Only allow renaming own conversations
-    conversation = await db.conversations.find_one({"id": conversation_id})
+    conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0, "user_id": 1})
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if conversation.get("user_id") != user["id"]:
@@ -858,7 +3008,7 @@ async def rename_conversation(conversation_id: str, update: ConversationUpdate,
     
     await db.conversations.update_one(
         {"id": conversation_id},
-        {"$set": {"title": update.title, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"title": update.title, "title_pending": False, "updated_at": utc_now()}}
     )
     return {"message": "Conversation renamed", "title": update.title}
 
@@ -866,7 +3016,7 @@ async def rename_conversation(conversation_id: str, update: ConversationUpdate,
 @api_router.post("/conversations/claim")
 async def claim_conversation(conversation_id: str, user: dict = Depends(require_auth)):
     """Claim a guest conversation for the logged-in user"""
-    conversation = await db.conversations.find_one({"id": conversation_id})
+    conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0, "user_id": 1})
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if conversation.get("user_id"):
@@ -892,6 +3042,8 @@ class FeedbackResponse(BaseModel):
     created_at: datetime
 
 # Feedback Routes
+FEEDBACK_KEEP = int(os.environ.get('FEEDBACK_KEEP', '10'))  # Only the newest are kept
+
 @api_router.post("/feedback")
 async def create_feedback(data: FeedbackCreate, user: dict = Depends(require_auth)):
     """Create a new feedback message"""
@@ -902,21 +3054,26 @@ async def create_feedback(data: FeedbackCreate, user: dict = Depends(require_aut
         "user_name": user.get("name", "Unbekannt"),
         "user_email": user["email"],
         "message": data.message,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": utc_now()
     }
     await db.feedback.insert_one(feedback)
     
-    # Keep only the 10 newest feedback messages
-    total_feedback = await db.feedback.count_documents({})
-    if total_feedback > 10:
-        # Get all feedback sorted by created_at (oldest first)
-        all_feedback = await db.feedback.find({}, {"_id": 0, "id": 1, "created_at": 1}).sort("created_at", 1).to_list(total_feedback)
-        # Calculate how many to delete
-        to_delete_count = total_feedback - 10
-        # Get IDs of oldest feedback to delete
-        ids_to_delete = [f["id"] for f in all_feedback[:to_delete_count]]
-        # Delete them
-        await db.feedback.delete_many({"id": {"$in": ids_to_delete}})
+    # Keep only the FEEDBACK_KEEP newest feedback messages: the first one beyond the
+    # limit is found by walking FEEDBACK_KEEP index entries, and it and everything
+    # older go in one delete - normally a single document
+    oldest_dropped = await db.feedback.find({}, {"_id": 1, "created_at": 1}).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).skip(FEEDBACK_KEEP).limit(1).to_list(1)
+    if oldest_dropped:
+        cutoff = oldest_dropped[0]
+        query = {"$or": [
+            {"created_at": {"$lt": cutoff["created_at"]}},
+            {"created_at": cutoff["created_at"], "_id": {"$lte": cutoff["_id"]}}
+        ]}
+        if isinstance(cutoff["created_at"], datetime):
+            # Not yet migrated ISO strings sort before all dates
+            query["$or"].append({"created_at": {"$type": "string"}})
+        await db.feedback.delete_many(query)
     
     return {"message": "Feedback erfolgreich gesendet", "id": feedback_id}
 
@@ -935,8 +3092,8 @@ async def require_admin(user: dict = Depends(require_auth)) -> dict:
 
 @api_router.get("/admin/feedback")
 async def get_all_feedback(user: dict = Depends(require_admin)):
-    """Get the 10 newest feedback messages (admin only)"""
-    feedback_list = await db.feedback.find({}, {"_id": 0}).sort("created_at", -1).to_list(10)
+    """Get the newest feedback messages (admin only)"""
+    feedback_list = await db.feedback.find({}, {"_id": 0}).sort([("created_at", -1), ("_id", -1)]).to_list(FEEDBACK_KEEP)
     return feedback_list
 
 @api_router.delete("/admin/feedback/{feedback_id}")
@@ -947,123 +3104,541 @@ async def delete_feedback(feedback_id: str, user: dict = Depends(require_admin))
         raise HTTPException(status_code=404, detail="Feedback nicht gefunden")
     return {"message": "Feedback gelöscht"}
 
+@api_router.get("/admin/answer-cache")
+async def get_answer_cache_stats(user: dict = Depends(require_admin)):
+    """Get answer cache metrics (admin only)"""
+    return answer_cache.metrics()
+
+@api_router.delete("/admin/answer-cache")
+async def clear_answer_cache(user: dict = Depends(require_admin)):
+    """Clear the answer cache (admin only)"""
+    answer_cache.clear()
+    return {"message": "Answer-Cache geleert"}
+
+@api_router.get("/admin/user-cache")
+async def get_user_cache_stats(user: dict = Depends(require_admin)):
+    """Get authenticated user cache metrics (admin only)"""
+    return user_cache.metrics()
+
+@api_router.get("/admin/thumbnails")
+async def get_thumbnail_stats(user: dict = Depends(require_admin)):
+    """Get thumbnail pipeline counters (admin only)"""
+    return thumbnail_stats
+
+@api_router.get("/admin/upload-limits")
+async def get_upload_limit_stats(user: dict = Depends(require_admin)):
+    """Get upload body limit counters (admin only)"""
+    return upload_limit_metrics()
+
+@api_router.get("/admin/rate-limits")
+async def get_rate_limit_stats(user: dict = Depends(require_admin)):
+    """Get auth rate limiting counters (admin only)"""
+    return rate_limiter.metrics()
+
+@api_router.get("/admin/password-hasher")
+async def get_password_hasher_stats(user: dict = Depends(require_admin)):
+    """Get password hashing pool metrics (admin only)"""
+    return password_hasher.metrics()
+
+@api_router.get("/admin/n8n-limiter")
+async def get_n8n_limiter_stats(user: dict = Depends(require_admin)):
+    """Get N8N concurrency limiter metrics (admin only)"""
+    return n8n_limiter.metrics()
+
+@api_router.get("/admin/n8n-endpoints")
+async def get_n8n_endpoint_stats(user: dict = Depends(require_admin)):
+    """Get N8N endpoint health and circuit breaker states (admin only)"""
+    return n8n_router.metrics()
+
+@api_router.get("/admin/indexes")
+async def get_index_report(user: dict = Depends(require_admin)):
+    """Get index usage per collection and registry indexes that are missing (admin only)"""
+    report = {}
+    for collection, indexes in DB_INDEXES.items():
+        stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+        existing = {stat["name"] for stat in stats}
+        report[collection] = {
+            "indexes": [
+                {
+                    "name": stat["name"],
+                    "key": stat["key"],
+                    "ops": stat["accesses"]["ops"],
+                    "since": stat["accesses"]["since"]
+                }
+                for stat in sorted(stats, key=lambda stat: stat["name"])
+            ],
+            "missing": [index.document["name"] for index in indexes if index.document["name"] not in existing]
+        }
+    return report
+
+# Analytics rollups
+# db.daily_stats holds one row per (UTC day, bundesland) with new_users, active_users,
+# messages and conversations counters, maintained incrementally by the endpoints.
+# db.daily_active_users holds one row per (day, user) and makes active_users exact.
+# db.bundesland_users counts users per bundesland for the top Bundesländer.
+# db.active_user_sketches holds a HyperLogLog sketch of the active user ids per day.
+
+# HyperLogLog: 2^12 registers, relative standard error 1.04 / sqrt(4096) ~ 1.6%
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_RELATIVE_ERROR = round(1.04 / math.sqrt(HLL_REGISTERS), 4)
+# Ranges up to this many days are counted exactly from db.daily_active_users
+ACTIVE_USERS_EXACT_MAX_DAYS = int(os.environ.get('ACTIVE_USERS_EXACT_MAX_DAYS', '31'))
+# Admin stats result cache: ranges that include today change with every chat,
+# closed ranges only change through a backfill
+STATS_CACHE_LIVE_TTL_SECONDS = float(os.environ.get('STATS_CACHE_LIVE_TTL_SECONDS', '60'))
+STATS_CACHE_CLOSED_TTL_SECONDS = float(os.environ.get('STATS_CACHE_CLOSED_TTL_SECONDS', str(24 * 3600)))
+STATS_CACHE_MAX_ENTRIES = 256
+
+
+class StatsCache:
+    """TTL cache for admin stats results. Concurrent misses for the same key share
+    one computation, so a burst of dashboard refreshes runs the queries once."""
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires, value), least recently used first
+        self.loading = {}  # key -> future of a running computation
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+    
+    async def get(self, key: tuple, ttl_seconds: float, load) -> tuple:
+        """Returns (value, hit)"""
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1], True
+        if key in self.loading:
+            self.stats["hits"] += 1
+            return await asyncio.shield(self.loading[key]), True
+        
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.loading[key] = future
+        generation = self.stats["invalidations"]
+        try:
+            value = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when nobody else is waiting
+            raise
+        else:
+            future.set_result(value)
+            # Results computed across an invalidation are returned but not stored
+            if generation == self.stats["invalidations"]:
+                self.entries[key] = (time.monotonic() + ttl_seconds, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            return value, False
+        finally:
+            self.loading.pop(key, None)
+    
+    def invalidate(self):
+        self.entries.clear()
+        self.stats["invalidations"] += 1
+    
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self.entries),
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None
+        }
+
+
+stats_cache = StatsCache(STATS_CACHE_MAX_ENTRIES)
+
+def day_key(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%d")
+
+
+def day_key_expr(field: str) -> dict:
+    """Aggregation expression for the UTC day (YYYY-MM-DD) of a timestamp field.
+    Legacy ISO strings (UTC) are cut to their date part."""
+    return {"$cond": [
+        {"$eq": [{"$type": f"${field}"}, "string"]},
+        {"$substrCP": [f"${field}", 0, 10]},
+        {"$dateToString": {"format": "%Y-%m-%d", "date": f"${field}"}}
+    ]}
+
+
+def hll_register(user_id: str) -> tuple:
+    """(register index, rank) of a user id in a HyperLogLog sketch"""
+    value = int.from_bytes(hashlib.blake2b(user_id.encode(), digest_size=8).digest(), "big")
+    rest_bits = 64 - HLL_PRECISION
+    rest = value & ((1 << rest_bits) - 1)
+    return value >> rest_bits, rest_bits - rest.bit_length() + 1
+
+
+def hll_estimate(registers: list) -> int:
+    """Cardinality estimate of a HyperLogLog sketch, with linear counting for small sets"""
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return round(estimate)
+
+
+async def add_to_active_user_sketch(day: str, registers: dict):
+    """Merge {register index: rank} into the sketch of a day. $max keeps this atomic
+    and idempotent, so concurrent requests and backfills can update the same day."""
+    await db.active_user_sketches.update_one(
+        {"day": day},
+        {"$max": {f"registers.{index}": rank for index, rank in registers.items()}},
+        upsert=True
+    )
+
+
+async def count_active_users(start_day: str, end_day: str, exact: bool) -> dict:
+    """Distinct active users between two UTC days (inclusive).
+    Exact counts come from the per-day markers, estimates from merging the daily
+    sketches, which needs constant memory whatever the range or number of users."""
+    if exact:
+        result = await db.daily_active_users.aggregate([
+            {"$match": {"day": {"$gte": start_day, "$lte": end_day}}},
+            {"$group": {"_id": "$user_id"}},
+            {"$count": "n"}
+        ]).to_list(1)
+        return {"count": result[0]["n"] if result else 0, "exact": True, "relative_error": 0.0}
+    
+    registers = [0] * HLL_REGISTERS
+    async for sketch in db.active_user_sketches.find({"day": {"$gte": start_day, "$lte": end_day}}, {"_id": 0, "registers": 1}):
+        for index, rank in sketch.get("registers", {}).items():
+            index = int(index)
+            if rank > registers[index]:
+                registers[index] = rank
+    return {"count": hll_estimate(registers), "exact": False, "relative_error": HLL_RELATIVE_ERROR}
+
+
+async def record_new_user():
+    await db.daily_stats.update_one(
+        {"day": day_key(utc_now()), "bundesland": None},
+        {"$inc": {"new_users": 1}},
+        upsert=True
+    )
+
+
+async def record_chat_activity(user_id: Optional[str], bundesland: Optional[str], new_conversation: bool):
+    """Count a stored user/assistant message pair in today's rollup row"""
+    try:
+        now = utc_now()
+        day = day_key(now)
+        counters = {"messages": 2, "conversations": 1 if new_conversation else 0}
+        if user_id:
+            result = await db.daily_active_users.update_one(
+                {"day": day, "user_id": user_id},
+                {"$setOnInsert": {"day": day, "user_id": user_id}},
+                upsert=True
+            )
+            if result.upserted_id is not None:
+                # First activity of this user today
+                counters["active_users"] = 1
+                index, rank = hll_register(user_id)
+                await add_to_active_user_sketch(day, {index: rank})
+                await db.users.update_one(
+                    {"id": user_id, "first_chat_at": {"$exists": False}},
+                    {"$set": {"first_chat_at": now}}
+                )
+        await db.daily_stats.update_one(
+            {"day": day, "bundesland": bundesland},
+            {"$inc": counters},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"Recording chat activity failed: {e}")
+
+
+async def update_bundesland_counts(old: Optional[str], new: Optional[str]):
+    if old == new:
+        return
+    if old:
+        await db.bundesland_users.update_one({"_id": old}, {"$inc": {"count": -1}})
+    if new:
+        await db.bundesland_users.update_one({"_id": new}, {"$inc": {"count": 1}}, upsert=True)
+
+
+async def backfill_daily_stats():
+    """Rebuild the rollups of all days before today from the stored history.
+    Idempotent: rows are overwritten, and today's rows are left to the live counters.
+    Per-bundesland numbers use each user's current bundesland."""
+    today = day_key(utc_now())
+    user_bundesland = [
+        {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "user"}},
+        {"$set": {"bundesland": {"$ifNull": [{"$first": "$user.bundesland"}, None]}}}
+    ]
+    
+    rows = {}
+    def add(day: str, bundesland: Optional[str], counter: str, value: int):
+        if day < today:
+            row = rows.setdefault((day, bundesland), {"new_users": 0, "active_users": 0, "messages": 0, "conversations": 0})
+            row[counter] += value
+    
+    async for item in db.users.aggregate([
+        {"$group": {"_id": day_key_expr("created_at"), "count": {"$sum": 1}}}
+    ]):
+        add(item["_id"], None, "new_users", item["count"])
+    
+    async for item in db.conversations.aggregate([
+        {"$group": {"_id": {"day": day_key_expr("created_at"), "user_id": "$user_id"}, "count": {"$sum": 1}}},
+        {"$set": {"user_id": "$_id.user_id"}},
+        *user_bundesland
+    ]):
+        add(item["_id"]["day"], item["bundesland"], "conversations", item["count"])
+    
+    active_rows = []
+    sketches = {}  # day -> {register index: rank}
+    async for item in db.messages.aggregate([
+        {"$group": {"_id": {"day": day_key_expr("timestamp"), "conversation_id": "$conversation_id"}, "count": {"$sum": 1}}},
+        {"$lookup": {"from": "conversations", "localField": "_id.conversation_id", "foreignField": "id", "as": "conversation"}},
+        {"$group": {
+            "_id": {"day": "$_id.day", "user_id": {"$ifNull": [{"$first": "$conversation.user_id"}, None]}},
+            "count": {"$sum": "$count"}
+        }},
+        {"$set": {"user_id": "$_id.user_id"}},
+        *user_bundesland
+    ]):
+        day, user_id = item["_id"]["day"], item["_id"]["user_id"]
+        add(day, item["bundesland"], "messages", item["count"])
+        if user_id and day < today:
+            add(day, item["bundesland"], "active_users", 1)
+            active_rows.append(UpdateOne({"day": day, "user_id": user_id}, {"$setOnInsert": {"day": day, "user_id": user_id}}, upsert=True))
+            index, rank = hll_register(user_id)
+            sketch = sketches.setdefault(day, {})
+            sketch[index] = max(rank, sketch.get(index, 0))
+    
+    for start in range(0, len(active_rows), 1000):
+        await db.daily_active_users.bulk_write(active_rows[start:start + 1000], ordered=False)
+    for day, registers in sketches.items():
+        await add_to_active_user_sketch(day, registers)
+    row_updates = [
+        UpdateOne({"day": day, "bundesland": bundesland}, {"$set": counters}, upsert=True)
+        for (day, bundesland), counters in rows.items()
+    ]
+    for start in range(0, len(row_updates), 1000):
+        await db.daily_stats.bulk_write(row_updates[start:start + 1000], ordered=False)
+    
+    # Users with chats and users per bundesland
+    async for item in db.conversations.aggregate([
+        {"$match": {"user_id": {"$ne": None}}},
+        {"$group": {"_id": "$user_id", "first": {"$min": "$created_at"}}}
+    ]):
+        await db.users.update_one(
+            {"id": item["_id"], "first_chat_at": {"$exists": False}},
+            {"$set": {"first_chat_at": as_datetime(item["first"])}}
+        )
+    async for item in db.users.aggregate([
+        {"$match": {"bundesland": {"$ne": None}}},
+        {"$group": {"_id": "$bundesland", "count": {"$sum": 1}}}
+    ]):
+        await db.bundesland_users.update_one({"_id": item["_id"]}, {"$set": {"count": item["count"]}}, upsert=True)
+    
+    stats_cache.invalidate()
+    logger.info(f"Backfilled {len(row_updates)} daily stats row(s)")
+
+
+@api_router.post("/admin/stats/backfill", status_code=202)
+async def start_stats_backfill(user: dict = Depends(require_admin)):
+    """Rebuild the daily statistics rollups from history in the background (admin only)"""
+    spawn_background(backfill_daily_stats())
+    return {"message": "Backfill gestartet"}
+
+
+async def load_period_stats(start_day: str, end_day: str, chart_days: List[str], exact: bool) -> dict:
+    """Range-dependent part of the admin stats"""
+    rows, active_in_period = await asyncio.gather(
+        db.daily_stats.find({"day": {"$gte": start_day, "$lte": end_day}}, {"_id": 0}).to_list(None),
+        count_active_users(start_day, end_day, exact)
+    )
+    per_day = {}
+    for row in rows:
+        day = per_day.setdefault(row["day"], {"new_users": 0, "active_users": 0})
+        day["new_users"] += row.get("new_users", 0)
+        day["active_users"] += row.get("active_users", 0)
+    
+    # Chart data - daily breakdown
+    chart_data = [
+        {
+            "date": datetime.strptime(day, "%Y-%m-%d").strftime("%d.%m"),
+            "new_users": per_day.get(day, {}).get("new_users", 0),
+            "active_users": per_day.get(day, {}).get("active_users", 0)
+        }
+        for day in chart_days
+    ]
+    return {
+        "new_users_in_period": sum(d["new_users"] for d in per_day.values()),
+        "active_users_in_period": active_in_period["count"],
+        "active_users_in_period_exact": active_in_period["exact"],
+        "active_users_in_period_error": active_in_period["relative_error"],
+        "chart_data": chart_data
+    }
+
+
+async def load_live_stats(today: str) -> dict:
+    """Totals and today's numbers of the admin stats, independent of the range"""
+    today_rows, total_users, total_conversations, total_messages, users_with_chats, top_bundeslaender = await asyncio.gather(
+        db.daily_stats.find({"day": today}, {"_id": 0, "active_users": 1}).to_list(None),
+        db.users.estimated_document_count(),
+        db.conversations.estimated_document_count(),
+        db.messages.estimated_document_count(),
+        db.users.count_documents({"first_chat_at": {"$exists": True}}),
+        db.bundesland_users.find({"count": {"$gt": 0}}).sort("count", -1).to_list(5)
+    )
+    
+    # Average messages per chat
+    avg_messages_per_chat = total_messages / total_conversations if total_conversations > 0 else 0
+    
+    return {
+        "total_users": total_users,
+        "active_users_today": sum(row.get("active_users", 0) for row in today_rows),
+        "total_conversations": total_conversations,
+        "total_messages": total_messages,
+        "avg_messages_per_chat": round(avg_messages_per_chat, 1),
+        "users_with_chats": users_with_chats,
+        "top_bundeslaender": [{"bundesland": item["_id"], "count": item["count"]} for item in top_bundeslaender]
+    }
+
+
 @api_router.get("/admin/stats")
 async def get_admin_stats(
     start_date: str,
     end_date: str,
+    response: Response,
+    exact: Optional[bool] = None,
     user: dict = Depends(require_admin)
 ):
-    """Get admin statistics for the dashboard"""
+    """Get admin statistics for the dashboard.
+    
+    Reads only the precomputed daily rollups and O(1) collection counts, so the
+    cost does not grow with the number of users or conversations. Days are UTC.
+    Active users in the period are counted exactly for ranges up to
+    ACTIVE_USERS_EXACT_MAX_DAYS and estimated with HyperLogLog beyond; `exact`
+    forces either mode.
+    
+    Results are cached per day range: ranges ending before today for
+    STATS_CACHE_CLOSED_TTL_SECONDS, everything else for STATS_CACHE_LIVE_TTL_SECONDS.
+    The Cache-Status header tells whether the response was served from the cache."""
     try:
-        start = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        end = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-        
-        # Total users (all time)
-        total_users = await db.users.count_documents({})
-        
-        # New users in period
-        new_users_in_period = await db.users.count_documents({
-            "created_at": {
-                "$gte": start.isoformat(),
-                "$lte": end.isoformat()
-            }
-        })
-        
-        # Active users today (who sent messages today)
-        today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-        active_users_today = len(await db.conversations.distinct("user_id", {
-            "user_id": {"$ne": None},
-            "updated_at": {"$gte": today_start.isoformat()}
-        }))
-        
-        # Active users in period (who sent messages in period)
-        active_users_in_period = len(await db.conversations.distinct("user_id", {
-            "user_id": {"$ne": None},
-            "updated_at": {
-                "$gte": start.isoformat(),
-                "$lte": end.isoformat()
-            }
-        }))
-        
-        # Total conversations and messages
-        total_conversations = await db.conversations.count_documents({})
-        
-        # Count total messages
-        pipeline = [
-            {"$project": {"message_count": {"$size": "$messages"}}},
-            {"$group": {"_id": None, "total": {"$sum": "$message_count"}}}
-        ]
-        message_result = await db.conversations.aggregate(pipeline).to_list(1)
-        total_messages = message_result[0]["total"] if message_result else 0
+        start = as_datetime(start_date).astimezone(timezone.utc)
+        end = as_datetime(end_date).astimezone(timezone.utc)
         
-        # Average messages per chat
-        avg_messages_per_chat = total_messages / total_conversations if total_conversations > 0 else 0
-        
-        # Users with chats
-        users_with_chats = len(await db.conversations.distinct("user_id", {"user_id": {"$ne": None}}))
-        
-        # Top Bundesländer
-        bundesland_pipeline = [
-            {"$match": {"bundesland": {"$ne": None}}},
-            {"$group": {"_id": "$bundesland", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 5}
-        ]
-        top_bundeslaender = await db.users.aggregate(bundesland_pipeline).to_list(5)
-        top_bundeslaender = [{"bundesland": item["_id"], "count": item["count"]} for item in top_bundeslaender]
-        
-        # Chart data - daily breakdown
-        from datetime import timedelta
-        
-        chart_data = []
-        current_date = start
-        
-        while current_date <= end:
-            day_start = current_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = day_start + timedelta(days=1)
-            
-            # New users on this day
-            new_users = await db.users.count_documents({
-                "created_at": {
-                    "$gte": day_start.isoformat(),
-                    "$lt": day_end.isoformat()
-                }
-            })
-            
-            # Active users on this day
-            active_users = len(await db.conversations.distinct("user_id", {
-                "user_id": {"$ne": None},
-                "updated_at": {
-                    "$gte": day_start.isoformat(),
-                    "$lt": day_end.isoformat()
-                }
-            }))
-            
-            chart_data.append({
-                "date": current_date.strftime("%d.%m"),
-                "new_users": new_users,
-                "active_users": active_users
-            })
-            
+        # Days of the chart, the range is normalized to whole UTC days
+        chart_days = []
+        current_date = start.date()
+        while current_date <= end.date():
+            chart_days.append(current_date.isoformat())
             current_date += timedelta(days=1)
+        start_day, end_day, today = day_key(start), day_key(end), day_key(utc_now())
+        if exact is None:
+            exact = len(chart_days) <= ACTIVE_USERS_EXACT_MAX_DAYS
         
-        return {
-            "total_users": total_users,
-            "new_users_in_period": new_users_in_period,
-            "active_users_today": active_users_today,
-            "active_users_in_period": active_users_in_period,
-            "total_conversations": total_conversations,
-            "total_messages": total_messages,
-            "avg_messages_per_chat": round(avg_messages_per_chat, 1),
-            "users_with_chats": users_with_chats,
-            "top_bundeslaender": top_bundeslaender,
-            "chart_data": chart_data
-        }
+        period_ttl = STATS_CACHE_CLOSED_TTL_SECONDS if end_day < today else STATS_CACHE_LIVE_TTL_SECONDS
+        (period, period_hit), (live, live_hit) = await asyncio.gather(
+            stats_cache.get(
+                ("period", start_day, end_day, exact), period_ttl,
+                lambda: load_period_stats(start_day, end_day, chart_days, exact)
+            ),
+            stats_cache.get(("live", today), STATS_CACHE_LIVE_TTL_SECONDS, lambda: load_live_stats(today))
+        )
+        response.headers["Cache-Status"] = "admin-stats; hit" if period_hit and live_hit else "admin-stats; fwd=miss"
+        
+        return {**live, **period}
         
     except Exception as e:
         logger.error(f"Admin stats error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/admin/stats/cache")
+async def get_stats_cache_stats(user: dict = Depends(require_admin)):
+    """Get admin stats cache metrics (admin only)"""
+    return stats_cache.metrics()
+
+@api_router.delete("/admin/stats/cache")
+async def clear_stats_cache(user: dict = Depends(require_admin)):
+    """Clear the admin stats cache (admin only)"""
+    stats_cache.invalidate()
+    return {"message": "Statistik-Cache geleert"}
+
+# Outbound HTTP settings
+N8N_POOL_MAX_CONNECTIONS = int(os.environ.get('N8N_POOL_MAX_CONNECTIONS', '100'))
+N8N_POOL_MAX_KEEPALIVE = int(os.environ.get('N8N_POOL_MAX_KEEPALIVE', '20'))
+N8N_HTTP2 = os.environ.get('N8N_HTTP2', 'false').lower() == 'true'
+N8N_WARMUP_CONNECTIONS = int(os.environ.get('N8N_WARMUP_CONNECTIONS', '2'))  # Per endpoint, at startup
+IMAGE_PROXY_POOL_MAX_CONNECTIONS = int(os.environ.get('IMAGE_PROXY_POOL_MAX_CONNECTIONS', '20'))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY_SECONDS', '60'))
+
+# Shared clients, created at startup
+http_client = None  # N8N webhooks
+proxy_http_client = None  # External images for the image proxy
+
+def create_n8n_client() -> httpx.AsyncClient:
+    """Client for N8N webhook calls, optionally speaking HTTP/2 (needs the h2 package)"""
+    http2 = N8N_HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("N8N_HTTP2 is enabled but the 'h2' package is not installed, using HTTP/1.1")
+        http2 = False
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(300.0, connect=30.0),  # 5 Minuten für KI-Antworten, 30 Sek. für Verbindung
+        limits=httpx.Limits(
+            max_connections=N8N_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=N8N_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+        ),
+        http2=http2
+    )
+
+def create_proxy_client() -> httpx.AsyncClient:
+    """Client for fetching external images"""
+    return httpx.AsyncClient(
+        timeout=30.0,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=IMAGE_PROXY_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=IMAGE_PROXY_POOL_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+        )
+    )
+
+async def warm_up_n8n_connections():
+    """Open keep-alive connections to every N8N endpoint so the first chats skip the TLS handshake.
+    Uses N8N's /healthz endpoint, which does not trigger any workflow."""
+    health_urls = {f"{urlsplit(e.url).scheme}://{urlsplit(e.url).netloc}/healthz" for e in n8n_router.endpoints}
+    results = await asyncio.gather(
+        *(http_client.get(url, timeout=10.0) for url in health_urls for _ in range(N8N_WARMUP_CONNECTIONS)),
+        return_exceptions=True
+    )
+    failed = [r for r in results if isinstance(r, Exception)]
+    for error in failed:
+        logger.info(f"N8N connection warm-up failed: {type(error).__name__} - {error}")
+    logger.info(f"Warmed up {len(results) - len(failed)} N8N connection(s)")
+
+def pool_stats(http: Optional[httpx.AsyncClient]) -> dict:
+    """Connection pool statistics. httpx has no public API for this, so it reads httpcore's pool."""
+    pool = getattr(getattr(http, "_transport", None), "_pool", None)
+    if pool is None:
+        return {"available": False}
+    connections = list(pool.connections)
+    idle = sum(1 for connection in connections if connection.is_idle())
+    waiting = sum(1 for request in getattr(pool, "_requests", []) if getattr(request, "connection", None) is None)
+    return {
+        "available": True,
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "waiting": waiting,
+        # The version negotiated via ALPN decides which protocol implementation httpcore uses
+        "http2": sum(1 for connection in connections if isinstance(getattr(connection, "_connection", None), httpcore.AsyncHTTP2Connection))
+    }
+
+@api_router.get("/admin/http-pools")
+async def get_http_pool_stats(user: dict = Depends(require_admin)):
+    """Get outbound connection pool statistics (admin only)"""
+    return {"n8n": pool_stats(http_client), "image_proxy": pool_stats(proxy_http_client)}
+
 # Image proxy cache: {url: (image_bytes, content_type, timestamp)}
 image_cache = {}
 CACHE_TTL_SECONDS = 300  # 5 minutes cache
@@ -1093,19 +3668,18 @@ async def image_proxy(url: str):
     try:
         # Fetch image from external URL
         logger.info(f"Fetching image from URL: {url}")
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            
-            # Get content type, default to image/png if not specified
-            content_type = response.headers.get("content-type", "image/png")
-            image_bytes = response.content
-            
-            # Cache the image
-            image_cache[url] = (image_bytes, content_type, current_time)
-            logger.info(f"Cached image for URL: {url}")
-            
-            return Response(content=image_bytes, media_type=content_type)
+        response = await proxy_http_client.get(url)
+        response.raise_for_status()
+        
+        # Get content type, default to image/png if not specified
+        content_type = response.headers.get("content-type", "image/png")
+        image_bytes = response.content
+        
+        # Cache the image
+        image_cache[url] = (image_bytes, content_type, current_time)
+        logger.info(f"Cached image for URL: {url}")
+        
+        return Response(content=image_bytes, media_type=content_type)
     
     except httpx.HTTPError as e:
         logger.error(f"Failed to fetch image from {url}: {e}")
@@ -1117,6 +3691,9 @@ async def image_proxy(url: str):
 # Include the router in the main app
 app.include_router(api_router)
 
+# Added before CORS so that early 413 responses still carry CORS headers
+app.add_middleware(UploadLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1132,16 +3709,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-http_client = None
-
 @app.on_event("startup")
 async def startup_event():
-    global http_client
-    http_client = httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=30.0))  # 5 Minuten für KI-Antworten, 30 Sek. für Verbindung
+    global http_client, proxy_http_client, thumbnail_pool
+    http_client = create_n8n_client()
+    proxy_http_client = create_proxy_client()
+    # Forking this multi-threaded process (Mongo monitors, bcrypt pool) could deadlock the child
+    thumbnail_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    spawn_background(warm_up_n8n_connections())
+    title_worker.start()
+    spawn_background(ensure_indexes())
+    spawn_background(run_migrations())
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    global http_client
+    await title_worker.stop()
+    password_hasher.shutdown()
+    if thumbnail_pool:
+        thumbnail_pool.shutdown(wait=False, cancel_futures=True)
     if http_client:
         await http_client.aclose()
+    if proxy_http_client:
+        await proxy_http_client.aclose()
     client.close()
\ No newline at end of file
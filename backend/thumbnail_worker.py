@@ -0,0 +1,22 @@
+"""Thumbnail generation for the process pool of server.py.
+
+Kept in its own module so worker processes (started via forkserver) only import
+Pillow and this file, not the whole server with its database client."""
+import io
+
+from PIL import Image, ImageOps
+
+
+def make_thumbnail(path: str, max_dimension: int, image_format: str, quality: int) -> tuple:
+    """Scale the image at path down to max_dimension.
+    Returns (thumbnail bytes, width, height)."""
+    with Image.open(path) as source:
+        # Lets the JPEG decoder scale down while decoding
+        source.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((max_dimension, max_dimension))
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha and image_format == "WEBP" else "RGB")
+        output = io.BytesIO()
+        image.save(output, image_format, quality=quality)
+        return output.getvalue(), image.width, image.height
@@ -9,10 +9,14 @@ import remarkMath from 'remark-math';
 import rehypeKatex from 'rehype-katex';
 import 'katex/dist/katex.min.css';
 import * as pdfjsLib from 'pdfjs-dist';
+import { BACKEND_URL } from '../utils/backendUrl';
 
 // Set up PDF.js worker - use local file instead of CDN
 pdfjsLib.GlobalWorkerOptions.workerSrc = '/pdf.worker.min.mjs';
 
+// Stored image attachments reference a server-side thumbnail instead of inline data
+const getThumbnailUrl = (file) => (file.thumbnail_url ? `${BACKEND_URL}${file.thumbnail_url}` : null);
+
 // Generate PDF thumbnail from base64 data
 const generatePdfThumbnailFromBase64 = async (base64Data) => {
   try {
@@ -83,6 +87,7 @@ const FilePreviewModal = ({ file, isOpen, onClose }) => {
       const mimeType = file.type || 'image/png';
       return `data:${mimeType};base64,${file.data}`;
     }
+    if (isImage) return getThumbnailUrl(file);
     return null;
   };
 
@@ -227,7 +232,7 @@ const FileAttachment = ({ file, compact = false, onClick }) => {
   }, [isPdf, file.data, file.preview, pdfThumbnail]);
 
   // Determine the preview image to show
-  const previewImage = file.preview || pdfThumbnail;
+  const previewImage = file.preview || getThumbnailUrl(file) || pdfThumbnail;
 
   // For audio files, show a different indicator (not clickable for preview)
   if (isAudio) {
@@ -175,6 +175,9 @@ export const useChatContext = () => {
   return context;
 };
 
+const TITLE_POLL_INTERVAL_MS = 1500;
+const TITLE_POLL_ATTEMPTS = 20;
+
 export const ChatProvider = ({ children }) => {
   const { isAuthenticated, token } = useAuth();
   const [conversations, setConversations] = useState([]);
@@ -269,6 +272,31 @@ export const ChatProvider = ({ children }) => {
     }
   }, [isAuthenticated]);
 
+  // The backend answers with a provisional title and generates the real one in the
+  // background; poll until it is stored and swap it in
+  const pollTitle = useCallback(async (conversationId) => {
+    for (let attempt = 0; attempt < TITLE_POLL_ATTEMPTS; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, TITLE_POLL_INTERVAL_MS));
+      try {
+        const response = await axios.get(`${API}/conversations/${conversationId}/title`);
+        if (response.data.title_pending) continue;
+        const title = response.data.title;
+        if (title) {
+          setConversations(prev => prev.map(c =>
+            c.id === conversationId ? { ...c, title } : c
+          ));
+          setCurrentGuestConversation(prev =>
+            prev && prev.id === conversationId ? { ...prev, title } : prev
+          );
+        }
+        return;
+      } catch (error) {
+        console.error('Failed to load conversation title:', error);
+        return;
+      }
+    }
+  }, []);
+
   const stopGeneration = useCallback(() => {
     if (isLoading) {
       // Cancel network request
@@ -434,6 +462,10 @@ export const ChatProvider = ({ children }) => {
         }
       }
 
+      if (response.data.title_pending) {
+        pollTitle(realConversationId);
+      }
+
     } catch (error) {
       if (axios.isCancel(error)) {
         console.log('Request canceled', error.message);
@@ -467,7 +499,7 @@ export const ChatProvider = ({ children }) => {
         abortControllerRef.current = null;
     }
 
-  }, [activeConversationId, currentGuestConversation, isAuthenticated]);
+  }, [activeConversationId, currentGuestConversation, isAuthenticated, pollTitle]);
 
   // Send message with files (images or PDFs) - supports multiple files
   const sendMessageWithFiles = useCallback(async (content, files, action) => {
@@ -673,6 +705,10 @@ export const ChatProvider = ({ children }) => {
         }
       }
 
+      if (response.data.title_pending) {
+        pollTitle(realConversationId);
+      }
+
     } catch (error) {
       if (axios.isCancel(error)) {
         console.log('Request canceled', error.message);
@@ -704,7 +740,7 @@ export const ChatProvider = ({ children }) => {
       abortControllerRef.current = null;
     }
 
-  }, [activeConversationId, currentGuestConversation, isAuthenticated, token]);
+  }, [activeConversationId, currentGuestConversation, isAuthenticated, token, pollTitle]);
 
   // Send voice message (audio recording)
   const sendVoiceMessage = useCallback(async (audioFile) => {
@@ -826,6 +862,10 @@ export const ChatProvider = ({ children }) => {
         }
       }
 
+      if (response.data.title_pending) {
+        pollTitle(realConversationId);
+      }
+
     } catch (error) {
       if (axios.isCancel(error)) {
         console.log('Request canceled', error.message);
@@ -857,7 +897,7 @@ export const ChatProvider = ({ children }) => {
       abortControllerRef.current = null;
     }
 
-  }, [activeConversationId, currentGuestConversation, isAuthenticated, token]);
+  }, [activeConversationId, currentGuestConversation, isAuthenticated, token, pollTitle]);
 
   const toggleSidebar = useCallback(() => {
     setSidebarOpen(prev => !prev);
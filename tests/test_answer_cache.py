@@ -0,0 +1,57 @@
+"""Unit tests for the answer cache near-duplicate tier (no server or database needed)"""
+import os
+import sys
+
+import pytest
+
+for module in ("fastapi", "motor", "passlib", "jwt", "emergentintegrations"):
+    pytest.importorskip(module)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("N8N_WEBHOOK_URL", "http://localhost:5678/webhook/test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from server import AnswerCache  # noqa: E402
+
+QUESTION = (
+    "Wie groß muss die Abstandsfläche in Bayern bei einer Wandhöhe von 10 m sein, "
+    "wenn das Gebäude im allgemeinen Wohngebiet steht?"
+)
+
+
+def make_cache(near_dup_enabled: bool) -> AnswerCache:
+    cache = AnswerCache(ttl_seconds=3600, max_bytes=1024 * 1024, near_dup_threshold=0.95, near_dup_enabled=near_dup_enabled)
+    cache.put(QUESTION, "Bayern", None, "Antwort für 10 m im Wohngebiet")
+    return cache
+
+
+def test_exact_match_ignores_case_and_punctuation():
+    cache = make_cache(near_dup_enabled=False)
+    assert cache.get(QUESTION.upper().replace("?", ""), "Bayern", None) == "Antwort für 10 m im Wohngebiet"
+
+
+def test_near_duplicates_are_off_by_default():
+    cache = make_cache(near_dup_enabled=False)
+    assert cache.get("Bitte: " + QUESTION, "Bayern", None) is None
+
+
+def test_near_duplicate_with_filler_words_hits():
+    cache = make_cache(near_dup_enabled=True)
+    assert cache.get("Hallo, bitte kurz: " + QUESTION, "Bayern", None) == "Antwort für 10 m im Wohngebiet"
+
+
+def test_different_number_misses():
+    cache = make_cache(near_dup_enabled=True)
+    assert cache.get(QUESTION.replace("10 m", "16 m"), "Bayern", None) is None
+
+
+def test_different_term_misses():
+    cache = make_cache(near_dup_enabled=True)
+    assert cache.get(QUESTION.replace("Wohngebiet", "Gewerbegebiet"), "Bayern", None) is None
+
+
+def test_other_bundesland_misses():
+    cache = make_cache(near_dup_enabled=True)
+    assert cache.get(QUESTION, "Berlin", None) is None
@@ -0,0 +1,39 @@
+"""Unit tests for the streamed multipart body sent to N8N (no server or database needed)"""
+import asyncio
+import io
+import os
+import sys
+
+import pytest
+
+for module in ("fastapi", "motor", "passlib", "jwt", "emergentintegrations"):
+    pytest.importorskip(module)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("N8N_WEBHOOK_URL", "http://localhost:5678/webhook/test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from fastapi import UploadFile  # noqa: E402
+from server import UPLOAD_CHUNK_SIZE, MultipartUpload  # noqa: E402
+
+
+async def read_body(multipart: MultipartUpload) -> bytes:
+    return b"".join([chunk async for chunk in multipart])
+
+
+def test_multipart_content_length_matches_body():
+    content = os.urandom(3 * UPLOAD_CHUNK_SIZE + 123)
+    files = [
+        ("file0", {"name": 'Plan "Süd".pdf', "type": "application/pdf", "size": len(content),
+                   "upload": UploadFile(io.BytesIO(content), filename="plan.pdf")}),
+        ("file1", {"name": "leer.png", "type": "image/png", "size": 0,
+                   "upload": UploadFile(io.BytesIO(b""), filename="leer.png")}),
+    ]
+    multipart = MultipartUpload({"message": "Grüße – Abstandsfläche?", "bundesland": "Bayern"}, files)
+    body = asyncio.run(read_body(multipart))
+    assert int(multipart.headers["Content-Length"]) == len(body)
+    assert content in body
+    # Sent again on a router retry: same length, files start from the beginning
+    assert asyncio.run(read_body(multipart)) == body
@@ -0,0 +1,125 @@
+"""Unit tests for the adaptive N8N concurrency limiter (no server or N8N needed)"""
+import asyncio
+import os
+import random
+import sys
+
+import pytest
+
+for module in ("fastapi", "motor", "passlib", "jwt", "emergentintegrations"):
+    pytest.importorskip(module)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("N8N_WEBHOOK_URL", "http://localhost:5678/webhook/test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import server  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+from server import N8nConcurrencyLimiter, N8nSlot  # noqa: E402
+
+WORKLOAD = "chat:default:full"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    return clock
+
+
+def make_limiter() -> N8nConcurrencyLimiter:
+    return N8nConcurrencyLimiter(min_limit=2, max_limit=64, initial_limit=16, max_queue=100, queue_timeout=30)
+
+
+def call(limiter: N8nConcurrencyLimiter, clock: Clock, latency: float, status: int = 200, interval: float = 0.1):
+    """One call answered by N8N after `latency` seconds, `interval` after the previous one"""
+    clock.now += interval
+    limiter.in_flight += 1
+    slot = N8nSlot(WORKLOAD, clock.now, 0.0)
+    slot.latency = latency
+    slot.status = status
+    slot.overloaded = status >= 500
+    limiter.release(slot)
+
+
+def test_calls_without_response_leave_limit_and_baseline_alone(clock):
+    limiter = make_limiter()
+    for _ in range(200):
+        call(limiter, clock, 15.0)
+    assert limiter.baseline_latency[WORKLOAD] == pytest.approx(15.0)
+    limit = limiter.limit
+
+    # All breakers open: the router rejects before N8N is reached
+    async def rejected():
+        async with limiter.slot(WORKLOAD):
+            raise HTTPException(status_code=503, detail="KI-Dienst ist nicht erreichbar.")
+    for _ in range(100):
+        with pytest.raises(HTTPException):
+            asyncio.run(rejected())
+    assert limiter.limit == limit
+    assert limiter.baseline_latency[WORKLOAD] == pytest.approx(15.0)
+
+    for _ in range(500):
+        call(limiter, clock, 15.0)
+    assert limiter.stats["decreases"] == 0
+    assert limiter.limit > limit
+
+
+def test_fast_client_errors_do_not_set_the_baseline(clock):
+    limiter = make_limiter()
+    for _ in range(50):
+        call(limiter, clock, 0.01, status=400)
+    assert WORKLOAD not in limiter.baseline_latency
+    for _ in range(200):
+        call(limiter, clock, 15.0)
+    assert limiter.baseline_latency[WORKLOAD] == pytest.approx(15.0)
+    assert limiter.stats["decreases"] == 0
+
+
+def test_too_low_baseline_recovers(clock):
+    limiter = make_limiter()
+    limiter.baseline_latency[WORKLOAD] = 0.5
+    for _ in range(5000):
+        call(limiter, clock, 15.0)
+    assert limiter.baseline_latency[WORKLOAD] > 7.5
+    decreases = limiter.stats["decreases"]
+    for _ in range(2000):
+        call(limiter, clock, 15.0)
+    assert limiter.stats["decreases"] == decreases
+
+
+@pytest.mark.parametrize("sigma", [0.3, 0.5, 0.8])
+def test_latency_spread_alone_does_not_throttle(clock, sigma):
+    limiter = make_limiter()
+    rng = random.Random(42)
+    for _ in range(5000):
+        call(limiter, clock, rng.lognormvariate(1.5, sigma))
+    assert limiter.limit >= 16
+
+
+def test_slow_windows_decrease_once_per_window(clock):
+    limiter = make_limiter()
+    for _ in range(200):
+        call(limiter, clock, 5.0)
+    # 200 calls 0.1 s apart span two windows
+    for _ in range(200):
+        call(limiter, clock, 30.0)
+    assert 1 <= limiter.stats["decreases"] <= 2
+
+
+def test_errors_decrease_once_per_window(clock):
+    limiter = make_limiter()
+    for _ in range(50):
+        call(limiter, clock, 1.0, status=502, interval=0.01)
+    assert limiter.stats["decreases"] == 1
+    assert limiter.limit == pytest.approx(16 * 0.9)
@@ -0,0 +1,106 @@
+"""Unit tests for the streaming upload limits (no server or database needed)"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+for module in ("fastapi", "motor", "passlib", "jwt", "emergentintegrations"):
+    pytest.importorskip(module)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("N8N_WEBHOOK_URL", "http://localhost:5678/webhook/test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from server import MAX_FILE_SIZE, MAX_FILES, UPLOAD_CHUNK_SIZE, UPLOAD_MAX_FIELDS, UploadLimitMiddleware  # noqa: E402
+
+BOUNDARY = "----TestBoundary7MA4YWxkTrZu0gW"
+
+
+def multipart_body(parts: list) -> bytes:
+    """Body with one file part per (filename, size) in `parts`"""
+    body = b""
+    for filename, size in parts:
+        body += (
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            f"Content-Type: application/pdf\r\n\r\n"
+        ).encode() + b"x" * size + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def split_at(body: bytes, positions: list) -> list:
+    edges = [0] + sorted(positions) + [len(body)]
+    return [body[start:end] for start, end in zip(edges, edges[1:])]
+
+
+def split_every(body: bytes, size: int) -> list:
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def upload(chunks: list, declared: bool = False) -> int:
+    """Send the chunks through UploadLimitMiddleware to an app that reads the whole
+    body. Returns the response status."""
+    sent = []
+    received = []
+
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise RuntimeError("client disconnected")
+            received.append(len(message["body"]))
+            if not message.get("more_body"):
+                break
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1} for i, chunk in enumerate(chunks)]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if declared:
+        headers.append((b"content-length", str(sum(len(chunk) for chunk in chunks)).encode()))
+    scope = {"type": "http", "method": "POST", "path": "/api/chat/upload", "headers": headers}
+    asyncio.run(UploadLimitMiddleware(app)(scope, receive, send))
+    return next(message["status"] for message in sent if message["type"] == "http.response.start")
+
+
+def test_file_of_exactly_max_size_passes():
+    body = multipart_body([("a.pdf", MAX_FILE_SIZE)])
+    assert upload(split_every(body, UPLOAD_CHUNK_SIZE)) == 200
+
+
+def test_delimiter_split_across_chunks_still_ends_the_part():
+    # Two files of the maximum size: if the delimiter between them were missed,
+    # they would count as one part of twice the size
+    body = multipart_body([("a.pdf", MAX_FILE_SIZE), ("b.pdf", MAX_FILE_SIZE)])
+    second = body.index(f"\r\n--{BOUNDARY}".encode(), 1)
+    for split in (second + 1, second + 4, second + 12):
+        assert upload(split_at(body, [split])) == 200
+
+
+def test_oversized_chunked_part_is_rejected():
+    body = multipart_body([("a.pdf", 30 * 1024 * 1024)])
+    assert upload(split_every(body, UPLOAD_CHUNK_SIZE)) == 413
+
+
+def test_oversized_declared_length_is_rejected():
+    body = multipart_body([("a.pdf", MAX_FILE_SIZE)] * (MAX_FILES + 1))
+    assert upload([body], declared=True) == 413
+
+
+def test_allowed_number_of_parts_passes_with_tiny_chunks():
+    body = multipart_body([(f"{i}.pdf", 10) for i in range(MAX_FILES + UPLOAD_MAX_FIELDS)])
+    assert upload(split_every(body, 7)) == 200
+
+
+def test_too_many_parts_are_rejected():
+    body = multipart_body([(f"{i}.pdf", 10) for i in range(20)])
+    assert upload(split_every(body, 7)) == 413